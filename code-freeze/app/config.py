@@ -1,4 +1,10 @@
 import os
+import json
+import asyncio
+import hashlib
+import logging
+from binascii import hexlify
+from collections import OrderedDict
 
 import version
 import timestamp
@@ -9,10 +15,30 @@ from .event_bus import event_bus
 CONFIG_DIR = '/config'
 CONFIG_EXT = "yaml"
 
+# parsed sections, loaded instead of the yaml if unchanged
+SNAPSHOT_DIR = '/config_snapshot'
+
+# changes made with set are written at most once per SAVE_DELAY_MS
+SAVE_DELAY_MS = 10_000
+
+# snapshot encodes (ordered) dicts as [ _DICT, key1, value1, key2, value2, ... ]
+_DICT = '\x00'
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+
 
 class Config:
 
     def __init__(self):
+        self._generation = 0
+        # section -> generation of its last change since load_config
+        self._changed = {}
+        # path -> _Accessor
+        self._accessors = {}
+        # sections changed by set, not yet saved
+        self._dirty = set()
+        self._save_task = None
         # copy default configuration
         try:
             os.mkdir(CONFIG_DIR)
@@ -20,55 +46,274 @@ class Config:
             pass
         cf = os.listdir(CONFIG_DIR)
         for k, v in cfg.items():
-            f = f"{CONFIG_DIR}/{k}.{CONFIG_EXT}"
+            f = f"{k}.{CONFIG_EXT}"
             if not f in cf:
-                with open(f, 'w') as stream:
+                with open(f"{CONFIG_DIR}/{f}", 'w') as stream:
                     stream.write(v)
         self.load_config()
 
     def load_config(self):
+        """Discard loaded sections, they are parsed again on first access."""
+        # section -> parsed content
         self._dict = {}
+        self._generation += 1
+        self._loaded = self._generation
+        self._changed = {}
+        # unsaved changes are discarded
+        self._dirty.clear()
+        # sections available in CONFIG_DIR
+        self._files = set()
+        for file_name in os.listdir(CONFIG_DIR):
+            section, ext = file_name.rsplit('.', 1)
+            # e.g. .tmp left by an interrupted save
+            if ext != CONFIG_EXT: continue
+            self._files.add(section)
+
+    def _section(self, section):
+        """Parsed section, loaded on first access. KeyError if it does not exist."""
         try:
-            dir = os.getcwd()
-            os.chdir(CONFIG_DIR)
-            for file_name in os.listdir(CONFIG_DIR):
-                with open(file_name) as stream:
-                    section, _ = file_name.rsplit('.', 1)
-                    self._dict[section] = y.load(stream, section)
+            return self._dict[section]
+        except KeyError:
+            pass
+        if section in self._files:
+            data = _load_section(f"{CONFIG_DIR}/{section}.{CONFIG_EXT}", section)
+        elif section == 'app':
+            data = None
+        else:
+            raise KeyError(section)
+        if section == 'app':
             # constants
-            app = self.get('app')
-            if not app:
-                app = self._dict['app']  = {}
-            app['version'] = version.VERSION
-            app['epoch_offset'] = timestamp.EPOCH_OFFSET
+            if not data:
+                data = OrderedDict()
+            data['version'] = version.VERSION
+            data['epoch_offset'] = timestamp.EPOCH_OFFSET
+        self._dict[section] = data
+        return data
 
-        finally:
-            os.chdir(dir)       
+    def release(self, *sections):
+        """Free memory of loaded sections (default: all) without unsaved changes.
+        They are loaded again on next access. Bumps their generation to drop cached references."""
+        for section in sections or list(self._dict.keys()):
+            if section in self._dict and not section in self._dirty:
+                del self._dict[section]
+                self._touch(section)
+
+    def _touch(self, section):
+        self._generation += 1
+        self._changed[section] = self._generation
 
     def reset(self):
         # recreate CONFIG_DIR from default_config
         for f in os.listdir(CONFIG_DIR):
             os.remove(f"{CONFIG_DIR}/{f}")
+        try:
+            for f in os.listdir(SNAPSHOT_DIR):
+                os.remove(f"{SNAPSHOT_DIR}/{f}")
+        except OSError:
+            pass
         for k, v in cfg.items():
             f = f"{CONFIG_DIR}/{k}.{CONFIG_EXT}"
             with open(f, 'w') as stream:
                 stream.write(v)
         self.load_config()
 
+    @property
+    def generation(self):
+        """Incremented whenever the configuration changes, used to invalidate caches."""
+        return self._generation
+
+    def section_generation(self, section):
+        """Changes when section changes, used to invalidate caches that depend on one section only."""
+        return self._changed.get(section, self._loaded)
+
     def get(self, path=None, default=None):
-        """Get value."""
-        if not path: return self._dict
+        """Get value. Without path, loads all sections."""
+        if not path:
+            for section in self._files:
+                self._section(section)
+            self._section('app')
+            return self._dict
         path = path.split('/')
-        res = self._dict
         try:
-            for p in path:
+            res = self._section(path[0])
+            for p in path[1:]:
                 res = res[p]
         except (KeyError, AttributeError):
             return default
         return res
 
+    def set(self, path, value):
+        """Set value, creating missing parents.
+        Posts config_changed with the changed leaves and saves the affected section
+        within SAVE_DELAY_MS. Returns False if value is unchanged."""
+        keys = path.split('/')
+        try:
+            self._section(keys[0])
+        except KeyError:
+            # new section
+            pass
+        d = self._dict
+        for k in keys[:-1]:
+            v = d.get(k)
+            if not isinstance(v, dict):
+                v = d[k] = OrderedDict()
+            d = v
+        key = keys[-1]
+        old = d.get(key)
+        value = _ordered(value)
+        changes = {}
+        _diff(path, old, value, changes)
+        if not changes: return False
+        d[key] = value
+        self._touch(keys[0])
+        self._dirty.add(keys[0])
+        if self._save_task is None:
+            self._save_task = asyncio.create_task(self._save_later())
+        asyncio.create_task(event_bus.post(type='config_changed', changes=changes))
+        return True
+
+    def save(self):
+        """Write sections changed by set to CONFIG_DIR."""
+        while self._dirty:
+            section = self._dirty.pop()
+            data = self._dict.get(section)
+            if section == 'app':
+                # constants are added by load_config
+                data = OrderedDict([ (k, v) for k, v in data.items() if not k in _CONSTANTS ])
+            f = f"{CONFIG_DIR}/{section}.{CONFIG_EXT}"
+            try:
+                # write-then-rename: a crash leaves either the old or the new file
+                with open(f + '.tmp', 'w') as stream:
+                    y.dump(data, stream)
+                os.rename(f + '.tmp', f)
+                self._files.add(section)
+            except Exception as e:
+                logger.exception(f"config save {section}", e)
+
+    async def _save_later(self):
+        # not restarted by further changes: bounds flash writes under continuous updates
+        try:
+            await asyncio.sleep_ms(SAVE_DELAY_MS)
+        finally:
+            self._save_task = None
+        self.save()
+
+    def accessor(self, path):
+        """Callable returning config.get(path, default), cached until the section of path changes.
+        Example:
+            devices = config.accessor('devices')
+            device = devices({}).get(mac)
+        """
+        acc = self._accessors.get(path)
+        if acc is None:
+            acc = self._accessors[path] = _Accessor(self, path)
+        return acc
+
     def __str__(self):
-        return y.dumps(self._dict)
+        return y.dumps(self.get())
+
+
+# marks missing values in _Accessor
+_MISSING = object()
+
+class _Accessor:
+
+    def __init__(self, config, path):
+        self._config = config
+        self._path = path
+        self._section = path.split('/')[0]
+        self._generation = None
+        self._value = _MISSING
+
+    def __call__(self, default=None):
+        config = self._config
+        generation = config.section_generation(self._section)
+        if self._generation != generation:
+            self._value = config.get(self._path, _MISSING)
+            self._generation = generation
+        value = self._value
+        return default if value is _MISSING else value
+
+
+# added to app section by load_config, not saved
+_CONSTANTS = ('version', 'epoch_offset')
+
+def _ordered(obj):
+    if isinstance(obj, dict):
+        return OrderedDict([ (k, _ordered(v)) for k, v in obj.items() ])
+    if isinstance(obj, list):
+        return [ _ordered(x) for x in obj ]
+    return obj
+
+def _diff(path, old, new, changes):
+    """Collect changed leaves of new vs old as changes[path] = value (None if removed)."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        for k, v in new.items():
+            _diff(f"{path}/{k}", old.get(k), v, changes)
+        for k in old:
+            if not k in new:
+                changes[f"{path}/{k}"] = None
+    elif old != new:
+        changes[path] = new
+
+def _load_section(file_name, section):
+    """Parse yaml file, or load its snapshot if the file is unchanged."""
+    digest = _digest(file_name)
+    snapshot = f"{SNAPSHOT_DIR}/{section}.json"
+    try:
+        with open(snapshot) as stream:
+            snap = json.load(stream)
+        if snap['digest'] == digest:
+            return _unpack(snap['data'])
+    except (OSError, ValueError, KeyError, TypeError):
+        # missing or corrupt snapshot
+        pass
+    with open(file_name) as stream:
+        data = y.load(stream, section)
+    try:
+        try:
+            os.mkdir(SNAPSHOT_DIR)
+        except OSError:
+            pass
+        # write-then-rename: never leave a partial snapshot behind
+        with open(snapshot + '.tmp', 'w') as stream:
+            json.dump({ 'digest': digest, 'data': _pack(data) }, stream)
+        os.rename(snapshot + '.tmp', snapshot)
+    except Exception as e:
+        logger.exception(f"config snapshot {section}", e)
+    return data
+
+def _digest(file_name):
+    # snapshot is valid for this file content and firmware version (parser)
+    h = hashlib.sha256(version.VERSION.encode())
+    buf = bytearray(512)
+    with open(file_name, 'rb') as stream:
+        while True:
+            n = stream.readinto(buf)
+            if not n: break
+            h.update(buf if n == len(buf) else buf[:n])
+    return hexlify(h.digest()).decode()
+
+def _pack(obj):
+    if isinstance(obj, dict):
+        res = [ _DICT ]
+        for k, v in obj.items():
+            res.append(k)
+            res.append(_pack(v))
+        return res
+    if isinstance(obj, list):
+        return [ _pack(x) for x in obj ]
+    return obj
+
+def _unpack(obj):
+    if isinstance(obj, list):
+        if obj and obj[0] == _DICT:
+            res = OrderedDict()
+            for i in range(1, len(obj), 2):
+                res[obj[i]] = _unpack(obj[i+1])
+            return res
+        return [ _unpack(x) for x in obj ]
+    return obj
 
 
 async def _handle_config_event(event):
@@ -83,4 +328,4 @@ async def _handle_config_event(event):
 # singleton
 config = Config()
 
-event_bus.subscribe(_handle_config_event)
+event_bus.subscribe(_handle_config_event, types=("get_config", "reset_config"))
@@ -9,31 +9,70 @@ from . config import config
 
 _ESC = re.compile(r"([.*+?^=!:${}()|\[\]\/\\])")
 
-def wildcard_match(s, rule):
+def compile_pattern(rule):
+    """Compiled regex for wildcard rule, e.g. '*.ram.*'.
+    A rule without '.' matches the last segment(s): 'voltage' -> '*.voltage'"""
     if not '.' in rule: rule = "*." + rule
     rule = "^" + ".*".join(map(lambda x: _ESC.sub(r'\\\1', x), rule.split("*"))) + "$"
-    return re.match(rule, s) != None
+    return re.compile(rule)
+
+def wildcard_match(s, rule):
+    return compile_pattern(rule).match(s) != None
+
+_devices = config.accessor('devices')
+
+# alias -> device_id, rebuilt when config 'devices' changes
+_aliases = {}
+_aliases_generation = None
 
 def device_id(entity_id):
     """Get device_id, possibly from alias"""
+    global _aliases, _aliases_generation
     d = entity_id.split('.')[1]
-    devices = config.get('devices')
+    devices = _devices({})
     # if it's in devices, it's a device_id!
     if d in devices: return d
     # check aliases
-    for k,v in devices.items():
-        if v.get('alias') == d:
-            # yup, return the corresponding id
-            return k
+    generation = config.section_generation('devices')
+    if _aliases_generation != generation:
+        _aliases = {}
+        for k, v in devices.items():
+            alias = v.get('alias') if v else None
+            # first device with alias wins
+            if alias and not alias in _aliases:
+                _aliases[alias] = k
+        _aliases_generation = generation
     # not in devices - there is no alias, hence d is the device_id
-    return d
+    return _aliases.get(d, d)
 
 def attr(entity_id, attribute, default=None):
-    for pattern, fields in config.get('entities').items():
-        if wildcard_match(entity_id, pattern):
-            if fields.get(attribute): 
-                return fields.get(attribute)
-    return default
+    return attrs(entity_id).get(attribute, default)
+
+# compiled patterns from config 'entities' and attributes resolved per entity
+# rebuilt when config 'entities' changes
+_patterns = []
+_resolved = {}
+_generation = None
+
+def attrs(entity_id):
+    """Attributes of entity from all matching patterns in config 'entities'.
+    The first pattern that sets an attribute wins. Don't alter the result."""
+    global _patterns, _resolved, _generation
+    generation = config.section_generation('entities')
+    if _generation != generation:
+        _patterns = [ (compile_pattern(p), f) for p, f in (config.get('entities') or {}).items() if f ]
+        _resolved = {}
+        _generation = generation
+    res = _resolved.get(entity_id)
+    if res is None:
+        res = {}
+        for regex, fields in _patterns:
+            if regex.match(entity_id):
+                for k, v in fields.items():
+                    if v and not k in res:
+                        res[k] = v
+        _resolved[entity_id] = res
+    return res
 
 
 #######################################################################
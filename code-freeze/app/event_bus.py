@@ -1,26 +1,213 @@
 import asyncio
-import timestamp
 import logging
 import gc
+from collections import deque
+from time import ticks_ms, ticks_diff   # type: ignore
+from timestamp import now
 from . import event_filter
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
+# queue overflow policies
+BLOCK       = 'block'          # producer waits for space
+DROP_OLDEST = 'drop_oldest'    # discard oldest queued event
+DROP_NEWEST = 'drop_newest'    # discard event being posted
+
+
+class _EventQueue:
+    """Bounded FIFO of events.
+    With coalesce, a state_update replaces a queued update of the same entity
+    in place (keeping its position), so only the latest value is delivered.
+    Any other event (e.g. state_batch, get_state_) closes all slots: later updates
+    queue behind it, so they are never delivered before older state it may carry."""
+
+    def __init__(self, size, overflow=BLOCK, coalesce=False):
+        assert overflow in (BLOCK, DROP_OLDEST, DROP_NEWEST), f"unknown overflow policy {overflow}"
+        self._q = deque((), size, 1)
+        self._size = size
+        self._overflow = overflow
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self.dropped = 0
+        # coalesce: entity_id -> [event], the slot of the queued state_update
+        self._slots = {} if coalesce else None
+        self.coalesced = 0
+        self._closed = False
+
+    def __len__(self):
+        return len(self._q)
+
+    async def put(self, event, wait=False):
+        """Enqueue, waiting for space if the policy is BLOCK or wait is True."""
+        while len(self._q) >= self._size and (wait or self._overflow == BLOCK):
+            if self._closed: return
+            self._not_full.clear()
+            await self._not_full.wait()
+        self.put_nowait(event)
+
+    def put_nowait(self, event):
+        """Enqueue without waiting; a full BLOCK queue drops its oldest event."""
+        q = self._q
+        slots = self._slots
+        if slots is not None and event.get('type') == 'state_update':
+            entity_id = event.get('entity_id')
+            slot = slots.get(entity_id)
+            if slot:
+                slot[0] = event
+                self.coalesced += 1
+                return
+            event = slots[entity_id] = [event]
+        elif slots:
+            # updates queued before event are older, must not be replaced by newer ones
+            slots.clear()
+        if len(q) >= self._size:
+            self.dropped += 1
+            if self._overflow == DROP_NEWEST:
+                self._release(event)
+                return
+            self._release(q.popleft())
+        q.append(event)
+        self._not_empty.set()
+
+    def get_nowait(self):
+        """Dequeue next event, raises IndexError if the queue is empty."""
+        event = self._release(self._q.popleft())
+        self._not_full.set()
+        return event
+
+    def _release(self, item):
+        # unwrap coalescing slot
+        if isinstance(item, list):
+            entity_id = item[0].get('entity_id')
+            # slot may have been closed by a later event
+            if self._slots.get(entity_id) is item:
+                del self._slots[entity_id]
+            item = item[0]
+        return item
+
+    async def wait(self):
+        """Wait until the queue holds at least one event."""
+        while not self._q:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+    def close(self):
+        """Release producers waiting for space, their events are discarded."""
+        self._closed = True
+        self._not_full.set()
+
+
+class _Mailbox:
+    """Subscriber with its own event queue and delivery task.
+    Events are queued without waiting (except for BLOCK) and handed to the
+    subscriber in order, so a slow subscriber does not stall the bus.
+    With dst, events addressed to dst are never dropped: the producer waits
+    for space instead. Events addressed to others are not queued."""
+
+    def __init__(self, subscriber, size, overflow, coalesce, dst=None):
+        self.subscriber = subscriber
+        self._queue = _EventQueue(size, overflow, coalesce)
+        self._dst = dst
+        self._block = overflow == BLOCK
+        self._busy = False
+        self._closed = False
+        # events that had to wait for the subscriber to finish earlier events
+        self.lagged = 0
+        self._task = asyncio.create_task(self._run())
+
+    async def __call__(self, event):
+        q = self._queue
+        wait = self._block
+        if self._dst is not None:
+            dst = event.get('dst', '*')
+            if dst != '*' and dst != self._dst: return
+            # e.g. chunks of a response, must not be dropped
+            wait = wait or dst == self._dst
+        if self._busy or len(q):
+            self.lagged += 1
+        if wait and asyncio.current_task() is not self._task:
+            await q.put(event, True)
+        else:
+            q.put_nowait(event)
+
+    @property
+    def dropped(self):
+        """Events discarded by the overflow policy."""
+        return self._queue.dropped
+
+    @property
+    def coalesced(self):
+        """state_updates superseded by a newer value before delivery."""
+        return self._queue.coalesced
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def close(self):
+        self._closed = True
+        self._queue.close()
+        if asyncio.current_task() is not self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        q = self._queue
+        while not self._closed:
+            await q.wait()
+            event = q.get_nowait()
+            self._busy = True
+            try:
+                await self.subscriber(event)
+            except Exception as e:
+                logger.exception(f"event_bus mailbox {event.get('type')}", e)
+            self._busy = False
+
 
 class _EventBus():
 
     def __init__(self):
-        self._subscribers = set()
+        # event type -> tuple of subscribers
+        # tuples are replaced, not mutated, on (un)subscribe so that dispatch
+        # can iterate while a handler unsubscribes (e.g. EventIO._close)
+        self._by_type = {}
+        # subscribers receiving all events
+        self._wildcard = ()
+        # subscriber -> _Mailbox, for subscribers with their own queue
+        self._mailboxes = {}
         self._total_events = 0
+        # entity_id -> compiled filter chain, valid for config generation _filter_generation
         self._event_filters = {}
+        self._filter_generation = None
+        # entity_id -> (spec text, chain), keeps chains (and their state) whose spec did not change
+        self._filter_specs = {}
+        # queued mode (see start_dispatcher)
+        self._queue = None
+        self._dispatcher = None
+
+    def start_dispatcher(self, queue_size=64, overflow=BLOCK, batch=16, gc_ms=1000, coalesce=False):
+        """Switch to queued delivery: post enqueues, a single task delivers events.
+        @param queue_size: maximum number of pending events
+        @param overflow: BLOCK, DROP_OLDEST, or DROP_NEWEST, applied when the queue is full
+        @param batch: events delivered before yielding to other tasks
+        @param gc_ms: minimum interval between gc.collect() calls
+        @param coalesce: deliver only the latest pending state_update of each entity"""
+        if self._queue is not None: return
+        if isinstance(coalesce, str):
+            # config returns strings
+            coalesce = coalesce.lower() == 'true'
+        self._queue = _EventQueue(int(queue_size), overflow, coalesce)
+        self._batch = int(batch)
+        self._gc_ms = int(gc_ms)
+        self._dispatcher = asyncio.create_task(self._dispatch_task())
 
     async def post(self, **event):
         if not 'type' in event: print("event_bus.post", event)
         assert 'type' in event
-        for sub in self._subscribers:
-            await sub(event)
-        self._total_events += 1
+        if self._queue is not None:
+            await self._enqueue(event)
+            return
+        await self._dispatch(event)
         # dev.run (and maybe other tasks) "crash silently" without this delay
         await asyncio.sleep_ms(10)
         # FIX: ssl memory issue
@@ -29,47 +216,163 @@ class _EventBus():
     async def post_response(self, event, response):
         event = event.copy()
         event['response'] = response
-        for sub in self._subscribers:
+        if self._queue is not None:
+            await self._enqueue(event)
+        else:
+            await self._dispatch(event)
+
+    async def _enqueue(self, event):
+        if asyncio.current_task() is self._dispatcher:
+            # posted by a subscriber: waiting for space would deadlock the dispatcher
+            self._queue.put_nowait(event)
+        else:
+            await self._queue.put(event)
+        # give the dispatcher (and everybody else) a chance to run
+        await asyncio.sleep_ms(0)
+
+    async def _dispatch_task(self):
+        q = self._queue
+        last_gc = ticks_ms()
+        while True:
+            await q.wait()
+            for _ in range(self._batch):
+                try:
+                    event = q.get_nowait()
+                except IndexError:
+                    break
+                try:
+                    await self._dispatch(event)
+                except Exception as e:
+                    logger.exception(f"event_bus dispatch {event.get('type')}", e)
+            if ticks_diff(ticks_ms(), last_gc) >= self._gc_ms:
+                # FIX: ssl memory issue
+                gc.collect()
+                last_gc = ticks_ms()
+            await asyncio.sleep_ms(0)
+
+    async def _dispatch(self, event):
+        for sub in self._wildcard:
+            await sub(event)
+        for sub in self._by_type.get(event['type'], ()):
             await sub(event)
         self._total_events += 1
 
-    async def post_state_update(self, device_id, attr_id, value, timestamp=timestamp.now()):
+    async def post_state_update(self, device_id, attr_id, value, timestamp=None):
+        if timestamp is None: timestamp = now()
+        entity_id = self._entity_id(device_id, attr_id)
+        value = self._filter(entity_id, value)
+        if value is event_filter.NO_UPDATE:
+            return
+        await self.post(type='state_update', entity_id=entity_id, value=value, timestamp=timestamp)
+
+    async def post_state_updates(self, device_id, values, timestamp=None):
+        """Post several attributes of a device as a single event.
+        @param values: dict attr_id -> value
+        Values that pass their filters are posted as one state_batch event
+        with updates = { entity_id: value }, or as a state_update if only one passes."""
+        if timestamp is None: timestamp = now()
+        updates = {}
+        for attr_id, value in values.items():
+            entity_id = self._entity_id(device_id, attr_id)
+            value = self._filter(entity_id, value)
+            if not value is event_filter.NO_UPDATE:
+                updates[entity_id] = value
+        if len(updates) > 1:
+            await self.post(type='state_batch', updates=updates, timestamp=timestamp)
+        elif updates:
+            entity_id, value = next(iter(updates.items()))
+            await self.post(type='state_update', entity_id=entity_id, value=value, timestamp=timestamp)
+
+    def _entity_id(self, device_id, attr_id):
         # recursive import
-        from .config import config
         from . import eid
-        entity_id = f"{eid.NODE_ID}.{device_id}.{attr_id}"
-        if not entity_id in self._event_filters:
-            # all defined filters
-            filters = { k[:-6].lower(): v for k,v in event_filter.__dict__.items() if k.endswith('Filter') }
-            # filters for this entity
+        return f"{eid.NODE_ID}.{device_id}.{attr_id}"
+
+    def _filter(self, entity_id, value):
+        """Apply filters of entity to value, returns event_filter.NO_UPDATE if value is dropped."""
+        # recursive import
+        from .config import config
+        generation = config.section_generation('entities')
+        if self._filter_generation != generation:
+            # filter specs may have changed
+            self._event_filters = {}
+            self._filter_generation = generation
+        chain = self._event_filters.get(entity_id)
+        if chain is None:
+            from . import eid
             spec = eid.attr(entity_id, 'filter', ['duplicate'])
-            spec = [ next(iter(f.items())) if isinstance(f, dict) else (f, None) for f in spec ]
-             # create filters
-            self._event_filters[entity_id] = ([ filters[f[0]](f[1]) for f in spec ])
-        # filter
-        try:
-            for f in self._event_filters[entity_id]:
-                value = f.filter(value)
-        except event_filter.NoUpdate:
-            return
-        await self.post(type='state_update', entity_id=entity_id, value=value, timestamp=timestamp)
+            # compare as text: config.set modifies specs in place
+            text = repr(spec)
+            prev = self._filter_specs.get(entity_id)
+            if prev and prev[0] == text:
+                chain = prev[1]
+            else:
+                chain = event_filter.compile_chain(spec)
+                self._filter_specs[entity_id] = (text, chain)
+            self._event_filters[entity_id] = chain
+        return chain.filter(value)
 
-    def subscribe(self, subscriber):
-        self._subscribers.add(subscriber)
+    def subscribe(self, subscriber, types=None, queue=0, overflow=DROP_OLDEST, coalesce=False, dst=None):
+        """Call subscriber for events of given types (default: all events).
+        @param types: event type or list of event types
+        @param queue: if > 0, deliver from a mailbox holding up to queue events
+        @param overflow: policy applied when the mailbox is full
+        @param coalesce: mailbox keeps only the latest pending state_update of each entity
+        @param dst: address of subscriber, events addressed to it wait for space in the mailbox
+               rather than being dropped, events addressed to others are not queued"""
+        if queue:
+            mailbox = self._mailboxes.get(subscriber)
+            if not mailbox:
+                mailbox = self._mailboxes[subscriber] = _Mailbox(subscriber, int(queue), overflow, coalesce, dst)
+            subscriber = mailbox
+        if types is None:
+            if not subscriber in self._wildcard:
+                self._wildcard += (subscriber,)
+            return
+        if isinstance(types, str):
+            types = (types,)
+        for t in types:
+            subs = self._by_type.get(t, ())
+            if not subscriber in subs:
+                self._by_type[t] = subs + (subscriber,)
 
     def unsubscribe(self, subscriber):
-        try:
-            self._subscribers.remove(subscriber)
-        except KeyError:
-            pass
+        mailbox = self._mailboxes.pop(subscriber, None)
+        if mailbox:
+            mailbox.close()
+            subscriber = mailbox
+        self._wildcard = tuple(s for s in self._wildcard if s != subscriber)
+        for t, subs in list(self._by_type.items()):
+            if subscriber in subs:
+                subs = tuple(s for s in subs if s != subscriber)
+                if subs:
+                    self._by_type[t] = subs
+                else:
+                    del self._by_type[t]
 
     def is_subscribed(self, subscriber):
-        return subscriber in self._subscribers
+        subscriber = self._mailboxes.get(subscriber, subscriber)
+        if subscriber in self._wildcard: return True
+        return any(subscriber in subs for subs in self._by_type.values())
     
     @property
     def total_events(self):
         return self._total_events
 
+    def mailbox(self, subscriber):
+        """Mailbox (with dropped, lagged, and pending counters) of subscriber or None."""
+        return self._mailboxes.get(subscriber)
+
+    @property
+    def dropped_events(self):
+        """Events discarded by the overflow policy of the queue."""
+        return self._queue.dropped if self._queue is not None else 0
+
+    @property
+    def pending_events(self):
+        """Events waiting in the queue for delivery."""
+        return len(self._queue) if self._queue is not None else 0
+
 
 # singleton
 event_bus = _EventBus()
@@ -1,4 +1,5 @@
 from time import ticks_ms, ticks_diff
+from array import array
 import logging
 
 logger = logging.getLogger(__name__)
@@ -7,9 +8,9 @@ logger.setLevel(logging.ERROR)
 """Filter state updates."""
 
 
-# raised by filter to signal no update
-class NoUpdate(Exception):
-    pass
+# returned by filter to signal no update
+# (a sentinel rather than an exception: most updates are dropped and raising is expensive)
+NO_UPDATE = object()
 
 
 class ABC:
@@ -20,6 +21,27 @@ class AbstractFilter(ABC):
     def filter(value):
         raise NotImplementedError("StateFilter is an abstract class")
 
+    def filter_at(self, value, t):
+        """Filter value sampled at time t [ms, ticks_ms], time based filters override this."""
+        return self.filter(value)
+
+    def filter_array(self, timestamps, values):
+        """Filter a block of samples.
+        @param timestamps: array of sample times [ms, ticks_ms]
+        @param values: array of samples
+        @return (timestamps, values) of samples that pass, values as array('f').
+                The timestamps array may be the one passed in."""
+        ts = array(timestamps.typecode)
+        vs = array('f')
+        f = self.filter_at
+        for i in range(len(values)):
+            t = timestamps[i]
+            v = f(values[i], t)
+            if not v is NO_UPDATE:
+                ts.append(t)
+                vs.append(v)
+        return ts, vs
+
 
 class DuplicateFilter(AbstractFilter):
 
@@ -28,7 +50,7 @@ class DuplicateFilter(AbstractFilter):
 
     def filter(self, value):
         if value == self.last:
-            raise NoUpdate()
+            return NO_UPDATE
         self.last = value
         return value
 
@@ -47,7 +69,7 @@ class AbstolFilter(AbstractFilter):
         self.last = value
         if delta < self.abstol:
             logger.debug(f"abstol {delta} < {self.abstol} v={value}")
-            raise NoUpdate()
+            return NO_UPDATE
         return value
 
 
@@ -60,7 +82,9 @@ class LpfFilter(AbstractFilter):
         self.last_t = None
 
     def filter(self, value):
-        t = ticks_ms()
+        return self.filter_at(value, ticks_ms())
+
+    def filter_at(self, value, t):
         if self.last_v == None:
             self.last_v = value
             self.last_t = t
@@ -79,6 +103,12 @@ class OffsetFilter(AbstractFilter):
 
     def filter(self, value):
         return value + self._offset
+
+    def affine(self):
+        return (1.0, self._offset)
+
+    def filter_array(self, timestamps, values):
+        return _affine_array(timestamps, values, 1.0, self._offset)
     
 
 class ScaleFilter(AbstractFilter):
@@ -88,3 +118,297 @@ class ScaleFilter(AbstractFilter):
 
     def filter(self, value):
         return value * self._scale
+
+    def affine(self):
+        return (self._scale, 0.0)
+
+    def filter_array(self, timestamps, values):
+        return _affine_array(timestamps, values, self._scale, 0.0)
+
+
+class AffineFilter(AbstractFilter):
+    """value*scale + offset, also result of fusing adjacent offset and scale filters.
+    Parameters:
+        - affine:
+            scale: 2
+            offset: -1
+    """
+
+    def __init__(self, params):
+        self._scale = float(params.get('scale', 1))
+        self._offset = float(params.get('offset', 0))
+
+    def filter(self, value):
+        return value * self._scale + self._offset
+
+    def affine(self):
+        return (self._scale, self._offset)
+
+    def filter_array(self, timestamps, values):
+        return _affine_array(timestamps, values, self._scale, self._offset)
+
+
+def _affine_array(timestamps, values, scale, offset):
+    # all samples pass, timestamps are returned unchanged
+    vs = array('f', values)
+    for i in range(len(vs)):
+        vs[i] = vs[i] * scale + offset
+    return timestamps, vs
+
+
+class RateFilter(AbstractFilter):
+    """Minimum interval [s] between updates, values arriving earlier are dropped."""
+
+    def __init__(self, interval):
+        self._interval = int(float(interval)*1000)
+        self._last_t = None
+
+    def filter(self, value):
+        return self.filter_at(value, ticks_ms())
+
+    def filter_at(self, value, t):
+        if self._last_t != None and ticks_diff(t, self._last_t) < self._interval:
+            return NO_UPDATE
+        self._last_t = t
+        return value
+
+
+class HeartbeatFilter(AbstractFilter):
+    """Like duplicate, but resends an unchanged value if nothing was sent for interval [s].
+    Use instead of duplicate."""
+
+    def __init__(self, interval):
+        self._interval = int(float(interval)*1000)
+        self.last = None
+        self._last_t = None
+
+    def filter(self, value):
+        return self.filter_at(value, ticks_ms())
+
+    def filter_at(self, value, t):
+        if self._last_t != None and value == self.last and ticks_diff(t, self._last_t) < self._interval:
+            return NO_UPDATE
+        self.last = value
+        self._last_t = t
+        return value
+
+
+class DeadbandFilter(AbstractFilter):
+    """Drop values within abstol + reltol*|last| of the last value sent,
+    unless nothing was sent for max_interval [s].
+    Parameters (all optional):
+        - deadband:
+            abstol: 0.01
+            reltol: 0.001
+            max_interval: 60
+    """
+
+    def __init__(self, params):
+        params = params or {}
+        self._abstol = float(params.get('abstol', 0))
+        self._reltol = float(params.get('reltol', 0))
+        max_interval = params.get('max_interval')
+        self._max_interval = int(float(max_interval)*1000) if max_interval else None
+        self.last = None
+        self._last_t = None
+
+    def filter(self, value):
+        return self.filter_at(value, ticks_ms())
+
+    def filter_at(self, value, t):
+        last = self.last
+        if last != None:
+            if abs(value - last) <= self._abstol + self._reltol*abs(last):
+                if self._max_interval == None or ticks_diff(t, self._last_t) < self._max_interval:
+                    logger.debug(f"deadband {value} ~ {last}")
+                    return NO_UPDATE
+        self.last = value
+        self._last_t = t
+        return value
+
+
+class _Window(AbstractFilter):
+    """Last n values in a preallocated ring buffer.
+    NaN values are dropped, they would spoil the window."""
+
+    def __init__(self, n):
+        self._n = int(n)
+        assert self._n > 0, "window size must be positive"
+        self._ring = array('f', [0.0]*self._n)
+        self._count = 0     # number of values in ring
+        self._next = 0      # insert position
+
+    def _push(self, value):
+        """Insert value, return the value it replaces (None while ring is not full)."""
+        i = self._next
+        old = self._ring[i] if self._count == self._n else None
+        self._ring[i] = value
+        self._next = (i+1) % self._n
+        if old == None: self._count += 1
+        return old
+
+
+class MeanFilter(_Window):
+    """Mean of last n values."""
+
+    def __init__(self, n):
+        super().__init__(n)
+        self._sum = 0.0
+
+    def filter(self, value):
+        if value != value: return NO_UPDATE
+        old = self._push(value)
+        if self._next == 0:
+            # recompute once per cycle to avoid accumulating rounding errors
+            ring = self._ring
+            s = 0.0
+            for i in range(self._count): s += ring[i]
+            self._sum = s
+        else:
+            self._sum += self._ring[self._next-1] - (old or 0.0)
+        return self._sum / self._count
+
+
+class MinFilter(_Window):
+    """Minimum of last n values."""
+
+    def filter(self, value):
+        if value != value: return NO_UPDATE
+        self._push(value)
+        ring = self._ring
+        m = ring[0]
+        for i in range(1, self._count):
+            if ring[i] < m: m = ring[i]
+        return m
+
+
+class MaxFilter(_Window):
+    """Maximum of last n values."""
+
+    def filter(self, value):
+        if value != value: return NO_UPDATE
+        self._push(value)
+        ring = self._ring
+        m = ring[0]
+        for i in range(1, self._count):
+            if ring[i] > m: m = ring[i]
+        return m
+
+
+class MedianFilter(_Window):
+    """Median of last n values, e.g. to reject spikes."""
+
+    def __init__(self, n):
+        super().__init__(n)
+        # window contents in ascending order
+        self._sorted = array('f', [0.0]*self._n)
+
+    def filter(self, value):
+        if value != value: return NO_UPDATE
+        old = self._push(value)
+        # stored value (rounded to float32)
+        value = self._ring[self._next-1]
+        srt = self._sorted
+        count = self._count
+        if old == None:
+            # window not full yet, grow
+            i = count-1
+        else:
+            # remove old value
+            i = 0
+            while srt[i] != old: i += 1
+        # shift to insertion point of new value
+        while i > 0 and srt[i-1] > value:
+            srt[i] = srt[i-1]
+            i -= 1
+        while i < count-1 and srt[i+1] < value:
+            srt[i] = srt[i+1]
+            i += 1
+        srt[i] = value
+        mid = count // 2
+        return srt[mid] if count % 2 else (srt[mid-1] + srt[mid]) / 2
+
+
+class DecimateFilter(AbstractFilter):
+    """Pass every n-th value, starting with the first."""
+
+    def __init__(self, n):
+        self._n = int(n)
+        self._count = 0
+
+    def filter(self, value):
+        i = self._count
+        self._count = (i+1) % self._n
+        if i:
+            return NO_UPDATE
+        return value
+
+    def filter_array(self, timestamps, values):
+        n = self._n
+        # index of first sample that passes
+        first = (n - self._count) % n
+        length = len(values)
+        ts = array(timestamps.typecode)
+        vs = array('f')
+        for i in range(first, length, n):
+            ts.append(timestamps[i])
+            vs.append(values[i])
+        self._count = (self._count + length) % n
+        return ts, vs
+
+
+# all defined filters: 'duplicate' -> DuplicateFilter, ...
+FILTERS = { k[:-6].lower(): v for k,v in globals().items() if k.endswith('Filter') }
+
+
+def compile_chain(spec):
+    """Compile filter spec into a FilterChain, chain.filter(value) returns value or NO_UPDATE.
+    @param spec: list of filter names or { name: parameter } dicts, e.g.
+                 [ 'duplicate', { 'offset': 1 }, { 'scale': 2 } ]
+    Adjacent offset, scale and affine filters are fused into one affine filter."""
+    filters = []
+    for f in spec:
+        name, param = next(iter(f.items())) if isinstance(f, dict) else (f, None)
+        f = FILTERS[name](param)
+        if hasattr(f, 'affine') and filters and hasattr(filters[-1], 'affine'):
+            # (v*a1 + b1)*a2 + b2
+            a1, b1 = filters[-1].affine()
+            a2, b2 = f.affine()
+            f = AffineFilter({ 'scale': a1*a2, 'offset': b1*a2 + b2 })
+            filters[-1] = f
+        else:
+            filters.append(f)
+    return FilterChain(filters)
+
+
+class FilterChain:
+    """Filters applied in sequence, created by compile_chain.
+    filter(value) is specialized for the number of filters."""
+
+    def __init__(self, filters):
+        self._filters = filters
+        fns = [ f.filter for f in filters ]
+        if not fns:
+            self.filter = lambda value: value
+        elif len(fns) == 1:
+            self.filter = fns[0]
+        elif len(fns) == 2:
+            f0, f1 = fns
+            def chain(value):
+                value = f0(value)
+                return value if value is NO_UPDATE else f1(value)
+            self.filter = chain
+        else:
+            def chain(value):
+                for f in fns:
+                    value = f(value)
+                    if value is NO_UPDATE: return value
+                return value
+            self.filter = chain
+
+    def filter_array(self, timestamps, values):
+        """Filter a block of samples, see AbstractFilter.filter_array."""
+        for f in self._filters:
+            if not len(values): break
+            timestamps, values = f.filter_array(timestamps, values)
+        return timestamps, values
@@ -2,9 +2,11 @@ from micropython import const
 import asyncio
 import json
 import logging
+import struct
 
 from app import event_bus
 from app import config
+from app import eid
 
 from features.current_state import state
 
@@ -14,23 +16,148 @@ logger.setLevel(logging.INFO)
 # ping client at this interval to test connection [sec]
 _PING_INTERVAL = float(config.get('app/timeouts/ping_ms', 5000))/1000
 _MAX_EVENT_SIZE = int(config.get('app/max_event_size', 100000))
+# events queued per client while its transport is busy
+_QUEUE_SIZE = int(config.get('app/event_io/queue_size', 32))
+# coalesce events sent within flush_ms into one frame (0: one frame per event) ...
+_FLUSH_MS = int(config.get('app/event_io/flush_ms', 0))
+# ... unless they exceed flush_bytes
+_FLUSH_BYTES = int(config.get('app/event_io/flush_bytes', 1024))
+
+# replies to control messages, never filtered
+_CONTROL_RESPONSES = ('pong', 'subscribe_', 'protocol_')
+
+# binary encoding (opt-in, see EventIO._protocol)
+# frame: sequence of records, JSON frames start with '{' (0x7b)
+_REC_ENTITY       = const(0x01)   # <BHB tag, handle, len + entity_id (utf-8)
+_REC_STATE        = const(0x02)   # <BHIB tag, handle, timestamp, value type + value
+_STATE_FMT        = '<BHIB'
+_VAL_NONE         = const(0)
+_VAL_FALSE        = const(1)
+_VAL_TRUE         = const(2)
+_VAL_INT          = const(3)      # <i
+_VAL_FLOAT        = const(4)      # <f
+_VAL_STR          = const(5)      # B len + utf-8
+
+# entity_id <-> handle, shared by all clients
+_handles = {}
+_entity_ids = []
+
+# last encoded event, shared by all clients: [ event, json, binary ]
+# only one: events may be large (get_config_, get_log_) and must not be kept alive
+_encode_cache = [None, None, None]
+
+
+def _cache_entry(event):
+    global _encode_cache
+    if _encode_cache[0] is not event:
+        _encode_cache = [event, None, None]
+    return _encode_cache
+
+
+def encode(event):
+    """JSON encoding of event.
+    Clients receive the same event object from event_bus; the encoding is
+    computed by the first and reused by the others until another event is encoded."""
+    entry = _cache_entry(event)
+    if entry[1] is None:
+        entry[1] = json.dumps(event)
+    return entry[1]
+
+
+def encode_binary(event):
+    """Binary records for state_update and state_batch events, shared like encode.
+    @return (records, handles) or None if the event must be sent as JSON"""
+    entry = _cache_entry(event)
+    if entry[2] is None:
+        # False: not packable
+        entry[2] = _pack_event(event) or False
+    return entry[2] or None
+
+
+def _pack_event(event):
+    et = event.get('type')
+    if et == 'state_update':
+        items = ((event.get('entity_id'), event.get('value')),)
+    elif et == 'state_batch':
+        items = event['updates'].items()
+    else:
+        return None
+    ts = event.get('timestamp')
+    if not isinstance(ts, int) or not 0 <= ts <= 0xffffffff:
+        return None
+    buf = bytearray()
+    handles = []
+    for entity_id, value in items:
+        handle = _handle(entity_id)
+        if handle is None: return None
+        if value is None:
+            buf += struct.pack(_STATE_FMT, _REC_STATE, handle, ts, _VAL_NONE)
+        elif value is True or value is False:
+            buf += struct.pack(_STATE_FMT, _REC_STATE, handle, ts, _VAL_TRUE if value else _VAL_FALSE)
+        elif isinstance(value, int):
+            if not -0x80000000 <= value <= 0x7fffffff: return None
+            buf += struct.pack(_STATE_FMT + 'i', _REC_STATE, handle, ts, _VAL_INT, value)
+        elif isinstance(value, float):
+            buf += struct.pack(_STATE_FMT + 'f', _REC_STATE, handle, ts, _VAL_FLOAT, value)
+        elif isinstance(value, str):
+            b = value.encode()
+            if len(b) > 255: return None
+            buf += struct.pack(_STATE_FMT + 'B', _REC_STATE, handle, ts, _VAL_STR, len(b))
+            buf += b
+        else:
+            return None
+        handles.append(handle)
+    return (bytes(buf), handles)
+
+
+def _handle(entity_id):
+    handle = _handles.get(entity_id)
+    if handle is None:
+        if len(_entity_ids) > 0xffff or len(entity_id.encode()) > 255:
+            return None
+        handle = _handles[entity_id] = len(_entity_ids)
+        _entity_ids.append(entity_id)
+    return handle
+
+
+def _entity_record(handle):
+    b = _entity_ids[handle].encode()
+    return struct.pack('<BHB', _REC_ENTITY, handle, len(b)) + b
 
 
 class EventIO:
 
     _next_client_id = 0
 
-    def __init__(self, ws):
+    def __init__(self, ws, queue_size=_QUEUE_SIZE):
         # ws: a websocket or something implementing the same interface (ble_peripheral)
+        # queue_size: events buffered for a slow client before the oldest are dropped
         self._ws = ws
         EventIO._next_client_id += 1
         self._client_id = f'event-io-{EventIO._next_client_id}'
+        # subscription filters (see _subscribe), None: everything
+        self._types = None
+        self._patterns = None
+        self._entity_match = {}
+        # binary protocol: handles already sent to client
+        self._binary = False
+        self._announced = set()
+        # frame coalescing (see _write)
+        self._flush_ms = _FLUSH_MS
+        self._flush_bytes = _FLUSH_BYTES
+        self._pending = []
+        self._pending_size = 0
+        self._pending_binary = False
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
         print(f"{'-'*20} new connection {self._client_id} from {type(ws).__name__}")
         logger.info(f"{'-'*20} new connection {self._client_id} from {type(ws).__name__}")
         # save bound method for later unsubscribe
         # Note: self._send produces different object each time it is called!
         self._susbscriber = self._send
-        event_bus.subscribe(self._susbscriber)
+        # a client that falls behind only needs the latest value of each entity,
+        # but all chunks of responses addressed to it (get_history_, get_state_)
+        event_bus.subscribe(self._susbscriber, queue=queue_size, coalesce=True, dst=self._client_id)
 
     async def receiver(self):
         while True:
@@ -42,6 +169,12 @@ class EventIO:
                 if event.get('type') == 'ping': 
                     event['type'] = 'pong'
                     await self._send(event)
+                elif event.get('type') == 'protocol':
+                    self._protocol(event)
+                    await self._send({ 'type': 'protocol_', 'encoding': 'binary' if self._binary else 'json', 'flush_ms': self._flush_ms, 'flush_bytes': self._flush_bytes })
+                elif event.get('type') == 'subscribe':
+                    self._subscribe(event)
+                    await self._send({ 'type': 'subscribe_', 'entities': event.get('entities'), 'types': event.get('types') })
                 else:
                     logger.debug(f"event.io {self._client_id} received {event}")
                     await event_bus.post(src=self._client_id, **event)
@@ -60,12 +193,29 @@ class EventIO:
             if event.get('src') == self._client_id: return
             # filter out what's not for us
             dst = event.get('dst', '*')
-            j = json.dumps(event)
-            if dst == self._client_id or dst == '*':
-                if len(j) > _MAX_EVENT_SIZE:
-                    logger.error(f"event ({event.get('type')}) exceeds maximum permitted message size ({len(j)} > {_MAX_EVENT_SIZE} Bytes), rejected")
-                else:
-                    await self._ws.send(j)
+            if dst != self._client_id and dst != '*': return
+            # events addressed to us bypass the subscription filters
+            if dst == '*':
+                event = self._filter(event)
+                if event is None: return
+            # responses and pongs are not delayed
+            et = event.get('type')
+            flush = et == 'pong' or et.endswith('_')
+            if self._binary:
+                packed = encode_binary(event)
+                if packed:
+                    records, handles = packed
+                    new = [ h for h in handles if not h in self._announced ]
+                    if new:
+                        records = b''.join(_entity_record(h) for h in new) + records
+                        self._announced.update(new)
+                    await self._write(records, True, flush)
+                    return
+            j = encode(event)
+            if len(j) > _MAX_EVENT_SIZE:
+                logger.error(f"event ({et}) exceeds maximum permitted message size ({len(j)} > {_MAX_EVENT_SIZE} Bytes), rejected")
+            else:
+                await self._write(j, False, flush)
         except OSError as e:
             if e.errno == 9:
                 # socket closed
@@ -76,8 +226,107 @@ class EventIO:
         except Exception as e:
             logger.exception("event_io._send", e)
 
+    async def _write(self, data, binary, flush):
+        """Send encoded event, coalescing frames if flush_ms > 0.
+        Pending JSON events are sent as { "type": "bundle", "events": [ ... ] },
+        pending binary records are concatenated. Pending data is flushed after
+        flush_ms, when it exceeds flush_bytes, on flush, or when the encoding changes."""
+        if self._flush_ms <= 0:
+            async with self._write_lock:
+                await self._ws.send(data)
+            return
+        if self._pending and binary != self._pending_binary:
+            await self._flush()
+        self._pending.append(data)
+        self._pending_size += len(data)
+        self._pending_binary = binary
+        if flush or self._pending_size >= self._flush_bytes:
+            await self._flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush(self):
+        pending = self._pending
+        if not pending: return
+        self._pending = []
+        self._pending_size = 0
+        if self._pending_binary:
+            data = b''.join(pending)
+        elif len(pending) == 1:
+            data = pending[0]
+        else:
+            data = '{"type": "bundle", "events": [' + ', '.join(pending) + ']}'
+        async with self._write_lock:
+            await self._ws.send(data)
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep_ms(self._flush_ms)
+            self._flush_task = None
+            await self._flush()
+        except OSError as e:
+            if e.errno == 9:
+                # socket closed
+                await self._close()
+            else:
+                logger.exception("***** EventIO._flush_later: OSError", e.errno)
+        except Exception as e:
+            logger.exception("event_io._flush_later", e)
+
+    def _protocol(self, event):
+        """Select encoding requested by client, e.g. { 'type': 'protocol', 'encoding': 'binary', 'flush_ms': 20 }
+        binary: state_update and state_batch are sent as binary frames, each entity_id
+        is sent once (_REC_ENTITY) and then referenced by its handle (_REC_STATE).
+        Other events (and values that can't be packed) are sent as JSON.
+        flush_ms, flush_bytes: optional, override frame coalescing (see _write)."""
+        self._binary = event.get('encoding') == 'binary'
+        self._announced = set()
+        self._flush_ms = int(event.get('flush_ms', self._flush_ms))
+        self._flush_bytes = int(event.get('flush_bytes', self._flush_bytes))
+
+    def _subscribe(self, event):
+        """Compile subscription filters sent by client, e.g.
+        { 'type': 'subscribe', 'entities': [ '*.ram.*', 'voltage' ], 'types': [ 'state_update', 'state_batch' ] }
+        Entity patterns use the syntax of eid.wildcard_match, missing or empty lists remove the filter."""
+        types = event.get('types')
+        entities = event.get('entities')
+        self._types = set(types) if types else None
+        self._patterns = [ eid.compile_pattern(p) for p in entities ] if entities else None
+        self._entity_match = {}
+
+    def _match(self, entity_id):
+        # cached, entities are few and updated often
+        m = self._entity_match.get(entity_id)
+        if m is None:
+            m = self._entity_match[entity_id] = any(p.match(entity_id) for p in self._patterns)
+        return m
+
+    def _filter(self, event):
+        """Event restricted to what client subscribed to, or None."""
+        et = event.get('type')
+        if et in _CONTROL_RESPONSES:
+            return event
+        if self._types is not None and not et in self._types:
+            return None
+        if self._patterns is None:
+            return event
+        if et == 'state_update':
+            return event if self._match(event.get('entity_id')) else None
+        if et == 'state_batch':
+            updates = event['updates']
+            wanted = { k: v for k, v in updates.items() if self._match(k) }
+            if len(wanted) == len(updates): return event
+            if not wanted: return None
+            event = event.copy()
+            event['updates'] = wanted
+        return event
+
     async def _close(self):
         print("event_io.close", self._client_id)
+        self._pending = []
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
         try:
             await self._ws.close()
         except OSError as e:
@@ -89,6 +338,9 @@ class EventIO:
         except Exception as e:
             logger.exception("_close", e)
         try:
+            mailbox = event_bus.mailbox(self._susbscriber)
+            if mailbox:
+                logger.info(f"{self._client_id}: {mailbox.dropped} events dropped, {mailbox.lagged} lagged, {mailbox.coalesced} coalesced")
             event_bus.unsubscribe(self._susbscriber)
         except Exception as e:
             logger.exception("unsubscribe", e)
@@ -96,6 +348,6 @@ class EventIO:
         logger.info(f"{'-'*20} connection with {self._client_id} CLOSED")
 
 
-async def serve(ws):
-    io = EventIO(ws)
+async def serve(ws, **kwargs):
+    io = EventIO(ws, **kwargs)
     await io.receiver()
@@ -82,6 +82,11 @@ async def main():
     loop.set_exception_handler(exception_handler)
 
     try:
+        # queued event delivery, if configured
+        bus = config.get('app/event_bus', {}) or {}
+        if int(bus.get('queue_size', 0)) > 0:
+            event_bus.start_dispatcher(**bus)
+
         from features.led import led
         led.pattern = led.GREEN_BLINK_SLOW
 
@@ -30,6 +30,8 @@ _SERVICE_TX       = bluetooth.UUID("4d8b9853-05af-4ea0-99a5-cdbf9fd4104b")
 
 _RX_QUEUE_SZ      = const(10)
 _TX_QUEUE_SZ      = const(10)
+# events buffered by EventIO while indications are in progress
+_EVENT_QUEUE_SZ   = const(16)
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -175,7 +177,7 @@ class BLEPeripheral:
             await self._connection.pair(bond=True)
             print(f"pairing complete, encrypted={self._connection.encrypted}, key_size={self._connection.key_size}")
 
-            asyncio.create_task(event_io.serve(self))
+            asyncio.create_task(event_io.serve(self, queue_size=_EVENT_QUEUE_SZ))
             # wait for disconnect
             print("ble_peripheral await disconnected")
             await self._connection.disconnected(None)
@@ -7,7 +7,7 @@ from struct import unpack
 from ucryptolib import aes   # type: ignore
 
 from app import config, event_bus
-update = event_bus.post_state_update
+update = event_bus.post_state_updates
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -72,12 +72,14 @@ async def parse_victron(data, dev, mac, device):
     if model == 0x1:
         # Solar charger
         state, error, v, i, y, p, ext = unpack('<BBhhHHH', decrypted)
-        await update(did, 'rssi', dev.rssi)
-        await update(did, 'state', _VICTRON_STATE.get(state, str(state)))
-        await update(did, 'voltage', v/100)
-        await update(did, 'current', i/10)
-        await update(did, 'energy', y*10.0)
-        await update(did, 'power', p)
+        await update(did, {
+            'rssi': dev.rssi,
+            'state': _VICTRON_STATE.get(state, str(state)),
+            'voltage': v/100,
+            'current': i/10,
+            'energy': y*10.0,
+            'power': p,
+        })
 
     elif model == 0x2:
         # Battery SOC monitor
@@ -88,13 +90,15 @@ async def parse_victron(data, dev, mac, device):
         T = aux/100 - 273.15 if c & 0b11 == 2 else float('nan')
         soc = ((soc & 0x3fff) >>4) / 10
 
-        await update(did, 'rssi', dev.rssi)
-        await update(did, 'time_to_go', ttg)
-        await update(did, 'voltage', v/100)
-        await update(did, 'current', i)
-        await update(did, 'energy', consumed/10)
-        await update(did, 'soc', soc)
-        await update(did, 'temperature', T)
+        await update(did, {
+            'rssi': dev.rssi,
+            'time_to_go': ttg,
+            'voltage': v/100,
+            'current': i,
+            'energy': consumed/10,
+            'soc': soc,
+            'temperature': T,
+        })
 
 
 async def parse_govee(data: bytes, dev, mac, device):
@@ -103,18 +107,23 @@ async def parse_govee(data: bytes, dev, mac, device):
     if device:
         did = device.get('alias', mac)
         logger.info(f"Govee {did} ({mac}) update T={temp/100}C H={humi/100}% batt={batt}% {dev.rssi}dBm")
-        await update(did, 'temperature', temp/100)
-        await update(did, 'humidity', humi/100)
-        await update(did, 'battery', batt)
-        await update(did, 'rssi', dev.rssi)
+        await update(did, {
+            'temperature': temp/100,
+            'humidity': humi/100,
+            'battery': batt,
+            'rssi': dev.rssi,
+        })
     else:
         config.set(f'discover/{mac}', {
             'alias': f'Govee_{mac}',
-            'description': f'Govee T/H {temp/100}C {dev.rssi}dBm'
+            # no readings: every change is saved to flash
+            'description': 'Govee T/H'
         })
         logger.info(f"discovered Govee {mac}, T={temp/100}C RSSI={dev.rssi}dBm")
 
 
+_devices = config.accessor('devices')
+
 _PARSER = {
     0xEC88: parse_govee,
     0x02E1: parse_victron,
@@ -130,7 +139,7 @@ async def _main():
                     if parser:
                         # check if device is registered
                         mac = dev.device.addr_hex().lower()
-                        device = config.get(f'devices/{mac}')
+                        device = _devices({}).get(mac)
                         await parser(data, dev, mac, device)
 
 
@@ -1,16 +1,53 @@
-from app import event_bus
+import os
+from app import event_bus, config
 
 # dict enity_id -> value
 # OK to inspect, don't alter
 state = {}
 
+# dict entity_id -> sequence number of its last update
+_seq = {}
+_last_seq = 0
+
+# identifies this boot, sequence numbers restart at 0 after reset
+_SESSION = int.from_bytes(os.urandom(4), 'little')
+
+# maximum number of entities per get_state_ response
+_CHUNK_SIZE = int(config.get('app/state_chunk_size', 50))
+
+
 async def _handle_update_event(event):
-    global state
+    global state, _last_seq
     et = event.get('type')
     if et == 'state_update':
-        state[event['entity_id']] = event['value']
+        _last_seq += 1
+        entity_id = event['entity_id']
+        state[entity_id] = event['value']
+        _seq[entity_id] = _last_seq
+    elif et == 'state_batch':
+        _last_seq += 1
+        for entity_id, value in event['updates'].items():
+            state[entity_id] = value
+            _seq[entity_id] = _last_seq
     elif et == 'get_state':
-        await event_bus.post(type='get_state_', data=state, dst=event.get('src', '*'))
+        await _send_state(event)
+
+
+async def _send_state(event):
+    """Respond to get_state with state, in chunks of at most _CHUNK_SIZE entities.
+    Optional since=<seq>, session=<session> (from a prior response) restricts
+    the response to entities updated after seq.
+    Response: get_state_ with data, seq, session, chunk, chunks"""
+    since = int(event.get('since', 0))
+    if since and event.get('session') == _SESSION:
+        keys = [ k for k, s in _seq.items() if s > since ]
+    else:
+        keys = list(state.keys())
+    seq = _last_seq
+    chunks = max(1, (len(keys) + _CHUNK_SIZE - 1) // _CHUNK_SIZE)
+    for i in range(chunks):
+        data = { k: state[k] for k in keys[i*_CHUNK_SIZE:(i+1)*_CHUNK_SIZE] }
+        await event_bus.post(type='get_state_', data=data, seq=seq, session=_SESSION, chunk=i, chunks=chunks, dst=event.get('src', '*'))
 
 
-event_bus.subscribe(_handle_update_event)
+event_bus.subscribe(_handle_update_event, types=("state_update", "state_batch", "get_state"))
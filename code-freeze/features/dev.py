@@ -63,5 +63,5 @@ async def _handle_dev_event(event):
             t = '\n'.join(t)
             print(f'\n<div class="exception">***** {e.value}\n{t}</div>')
 
-event_bus.subscribe(_handle_dev_event)
+event_bus.subscribe(_handle_dev_event, types="exec")
 
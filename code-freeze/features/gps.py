@@ -11,7 +11,7 @@ from app import event_bus
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
 
-update = event_bus.post_state_update
+update = event_bus.post_state_updates
     
 class GPS:
     
@@ -41,13 +41,15 @@ class GPS:
         d, s = unpack('2s8s', fields[1])
         lat = int(d) + float(s)/60
         lat = -lat if fields[2] == 'S' else lat
-        await update('gps', 'latitude', lat)
         d, s = unpack('3s8s', fields[3])
         lon = int(d) + float(s)/60
         lon = -lon if fields[4] == 'W' else lon
-        await update('gps', 'longitude', lon)
-        await update('gps', 'altitude', float(fields[8]))
-        await update('gps', 'nsat', int(fields[6]))
+        await update('gps', {
+            'latitude': lat,
+            'longitude': lon,
+            'altitude': float(fields[8]),
+            'nsat': int(fields[6]),
+        })
         
     async def _parse_rmc(self, fields):
         if not self.valid: return
@@ -57,8 +59,7 @@ class GPS:
         # c-python epoch starts in 1970, micropython 2000: on client, add
         #       timestamp.EPOCH_OFFSET 
         # to get c-python epoch
-        await update('gps', 'epoch', epoch)
-        await update('gps', 'iso', timestamp.to_isodate(epoch))
+        await update('gps', { 'epoch': epoch, 'iso': timestamp.to_isodate(epoch) })
         if abs(time.time() - epoch) > 2:
             self.set_time(epoch)
 
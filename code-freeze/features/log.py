@@ -29,4 +29,4 @@ def init(size=10, level='WARNING'):
     except StopIteration:
         _levelno = logging.WARNING
     _log = deque((), int(size))
-    event_bus.subscribe(_handle_log_event)
+    event_bus.subscribe(_handle_log_event, types=("log", "get_log"))
@@ -21,4 +21,4 @@ async def _handle_ota_event(event):
                 await ota.ota(url, sha)
 
 
-event_bus.subscribe(_handle_ota_event)
+event_bus.subscribe(_handle_ota_event, types="ota_flash")
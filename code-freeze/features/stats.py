@@ -28,6 +28,7 @@ async def send_stats(period):
 
     last_call_ms = ticks_ms()
     last_event_total = 0
+    last_dropped_total = 0
     while True:
         await asyncio.sleep(period)
 
@@ -38,12 +39,15 @@ async def send_stats(period):
         events = event_bus.total_events
         await update('stats', 'events', (events-last_event_total)/dt)
         last_event_total = events
+        dropped = event_bus.dropped_events
+        await update('stats', 'dropped', (dropped-last_dropped_total)/dt)
+        last_dropped_total = dropped
 
         # latency statistics
         N = 0.01*sum(_COUNTS)
-        for i, b in enumerate(_BREAKS):
-            await update('stats', f'latency < {b:4.0f} ms', _COUNTS[i]/N)
-        await update('stats', f'latency > {_BREAKS[-1]:4.0f} ms', _COUNTS[-1]/N)
+        latency = { f'latency < {b:4.0f} ms': _COUNTS[i]/N for i, b in enumerate(_BREAKS) }
+        latency[f'latency > {_BREAKS[-1]:4.0f} ms'] = _COUNTS[-1]/N
+        await event_bus.post_state_updates('stats', latency)
 
 
 async def latency(period_ms):
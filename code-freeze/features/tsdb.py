@@ -3,7 +3,9 @@ import io
 import logging
 import math
 import struct
+import asyncio
 from array import array
+from time import ticks_ms, ticks_diff
 from micropython import const  # type: ignore
 
 logger = logging.getLogger(__name__)
@@ -23,6 +25,12 @@ DIR_TYPE_DEL    = const(0x00000000)   # deleted
 ITEM_FMT        = "If"                # timestamp (uint), value (float)
 ITEM_SIZE       = const(8)            # bytes
 
+# record index, next (cursor checkpoint, written when next moves to another block)
+JOURNAL_FMT     = "2I"
+JOURNAL_SIZE    = const(8)            # bytes
+
+BLANK = b'\xff\xff\xff\xff\xff\xff\xff\xff'
+
 
 class TSDBException(Exception):
     pass
@@ -31,10 +39,11 @@ class TSDBException(Exception):
 class TSDB:
 
     @classmethod
-    def make_db(cls, block_dev, capacity: int, config={}):
+    def make_db(cls, block_dev, capacity: int, config={}, journal_blocks=0):
         """Erase create empty db (erases existing data)
         @param capacity: Maximum number of records the db can hold
-        @param config: optional configuration data"""
+        @param config: optional configuration data
+        @param journal_blocks: blocks reserved for cursor checkpoints, speed up opening the db"""
         BLOCK_SIZE = block_dev.ioctl(5, None)
         assert is_power_of_2(ITEM_SIZE), f"ITEM_SIZE ({ITEM_SIZE}) must be a power of two"
         assert is_power_of_2(BLOCK_SIZE), f"block size ({BLOCK_SIZE}) must be a power of two"
@@ -42,20 +51,28 @@ class TSDB:
 
         # write configuration to block[0]
         _erase_block(block_dev, 0)
+        # copy, don't modify the caller's (or the default) dict
+        config = dict(config)
         config['description'] = "Time Series DataBase"
         config['version'] = VERSION
         config['magic'] = MAGIC
         config['block_size'] = BLOCK_SIZE
         config['num_dir_blocks'] = int(math.ceil(capacity*DIR_RECORD_SIZE/BLOCK_SIZE))
+        if journal_blocks:
+            config['num_journal_blocks'] = journal_blocks
         j = json.dumps(config).encode()
         assert len(j) <= BLOCK_SIZE, f"configuration data ({len(j)}) exceeds BLOCK_SIZE ({BLOCK_SIZE})"
         block_dev.writeblocks(0, j, 0)
-        # erase directory blocks
-        for i in range(1, config['num_dir_blocks']+1):
+        # erase directory and journal blocks
+        for i in range(1, config['num_dir_blocks']+journal_blocks+1):
             _erase_block(block_dev, i)
       
-    def __init__(self, block_dev):
+    def __init__(self, block_dev, buffer_items=0, flush_ms=10_000):
         """Open a database previously created with TSDB.make_db.
+        @param buffer_items: stage up to this many items per record in RAM and write them to
+               block_dev with a single writeblocks call. 0: write each item on append.
+        @param flush_ms: write staged items at the next append at least flush_ms after the first.
+               Call flush() periodically to write records that receive no further items.
         @exception TSDBException for corrupted database
         
         Example:
@@ -70,8 +87,18 @@ class TSDB:
         self.NBLOCKS = block_dev.ioctl(4, None)      # number of blocks in block_dev
         self.BLOCK_SIZE = block_dev.ioctl(5, None)   # block size in bytes
         self._bdev = block_dev
+        self._buffer_items = buffer_items
+        self._flush_ms = flush_ms
+        self._item = bytearray(ITEM_SIZE)
         self._read_header()
         self._read_records()
+        # records are located after the directory and journal
+        self._journal_addr = self._config['num_dir_blocks'] + 1
+        self._journal_blocks = self._config.get('num_journal_blocks', 0)
+        self._data_addr = self._journal_addr + self._journal_blocks
+        checkpoints = self._read_journal()
+        for index, rec in enumerate(self._records):
+            self._find_start_next(rec, checkpoints.get(index))
 
     @property
     def config(self):
@@ -98,7 +125,7 @@ class TSDB:
         Each additional block adds BLOCK_SIZE/ITEM_SIZE items.
         A record with N blocks holds (N-1)*BLOCK_SIZE/ITEM_SIZE-1 items."""
         if len(self._records) < 1:
-            return self.NBLOCKS - self._config['num_dir_blocks'] - 1
+            return self.NBLOCKS - self._data_addr
         else:
             r = self._records[-1]
             return self.NBLOCKS - r['block_addr'] - r['nblocks']
@@ -108,32 +135,35 @@ class TSDB:
         """Keys to all records stored in the database."""
         return [ r['key'] for r in self._records if r['type'] == DIR_TYPE_CBUF ]
 
-    def values(self, key: str, ignore_deleted=True) -> dict:
+    def values(self, key: str, t_from=None, t_to=None, limit=None, ignore_deleted=True) -> dict:
         """Dict with timestamps and values as arrays.
+        @param t_from, t_to: only items with t_from <= timestamp <= t_to (None: no bound)
+        @param limit: at most limit items, the oldest in the range
         @param ignore_deleted: set to False to return values records marked "deleted"
         """
         rec = self._find_record(key, ignore_deleted)
-        BLOCK_SIZE = self.BLOCK_SIZE
-        nblocks = rec['nblocks']
-        buf = bytearray(BLOCK_SIZE)
-        bdev = self._bdev
-        blank = b'\xff\xff\xff\xff\xff\xff\xff\xff'
         val = array('f')
         ts  = array('I')
-        start  = rec['start']
-        block  = start // BLOCK_SIZE
-        mv = memoryview(buf)
-        while True:
-            assert block < nblocks
-            bdev.readblocks(rec['block_addr'] + block, buf)
-            for offset in range(0, BLOCK_SIZE, ITEM_SIZE):
-                item = mv[offset:offset+ITEM_SIZE]
-                if item == blank: 
-                    return { 'timestamps': ts, 'values': val }
-                t, v = struct.unpack(ITEM_FMT, item)
-                val.append(v)
-                ts.append(t)
-            block = (block+1) % nblocks
+        for buf, n in self._buffers(rec, t_from):
+            if _decode(buf, n, ts, val, t_from, t_to, limit):
+                break
+        return { 'timestamps': ts, 'values': val }
+
+    def iter_values(self, key: str, t_from=None, t_to=None, chunk=128, ignore_deleted=True):
+        """Like values, but yields dicts with at most chunk items each.
+        Memory use is independent of the size of the result.
+        Raises TSDBException on the first iteration if key is not in the database."""
+        rec = self._find_record(key, ignore_deleted)
+        val = array('f')
+        ts  = array('I')
+        for buf, n in self._buffers(rec, t_from):
+            done = _decode(buf, n, ts, val, t_from, t_to, None)
+            while len(ts) >= chunk:
+                yield { 'timestamps': ts[:chunk], 'values': val[:chunk] }
+                ts, val = ts[chunk:], val[chunk:]
+            if done: break
+        if ts:
+            yield { 'timestamps': ts, 'values': val }
 
     def create_record(self, key: str, capacity=1023):
         """Create new time-series record with given key (if it does not exist already).
@@ -152,7 +182,7 @@ class TSDB:
         if len(self._records) >= self.capacity:
             raise TSDBException('Directory structure full')
         if len(self._records) < 1:
-            block_addr = self._config['num_dir_blocks'] + 1
+            block_addr = self._data_addr
         else:
             r = self._records[-1]
             block_addr = r['block_addr'] + r['nblocks']
@@ -164,7 +194,7 @@ class TSDB:
         for i in range(block_addr, block_addr+nblocks):
             _erase_block(self._bdev, i)
         # write new record
-        rec = struct.pack(DIR_RECORD_FMT, DIR_TYPE_CBUF, block_addr, nblocks, key)
+        rec = struct.pack(DIR_RECORD_FMT, DIR_TYPE_CBUF, block_addr, nblocks, key.encode())
         byte_addr = len(self._records)*DIR_RECORD_SIZE
         block_num = byte_addr // self.BLOCK_SIZE
         offset    = byte_addr %  self.BLOCK_SIZE
@@ -183,12 +213,55 @@ class TSDB:
         if BLOCK_SIZE-offset <= ITEM_SIZE:
             nxt_block = (block+1) % nblocks
             _erase_block(self._bdev, rec['block_addr']+nxt_block)
-            rec['start'] = ((nxt_block+1) % nblocks) * BLOCK_SIZE
-        # write
-        self._bdev.writeblocks(rec['block_addr']+block, struct.pack(ITEM_FMT, timestamp, value), offset)
+            rec['start'] = self._start(rec, nxt_block*BLOCK_SIZE)
+        if self._buffer_items:
+            self._stage(rec, nxt, timestamp, value, BLOCK_SIZE-offset <= ITEM_SIZE)
+        else:
+            # write
+            self._bdev.writeblocks(rec['block_addr']+block, struct.pack(ITEM_FMT, timestamp, value), offset)
         # compute new p
         rec['next'] = (nxt + ITEM_SIZE) % (nblocks * BLOCK_SIZE)
 
+    def flush(self, key=None):
+        """Write items staged in RAM to block_dev (all records if key is None).
+        Flushing all records also checkpoints their cursors."""
+        if key is None:
+            for rec in self._records:
+                self._flush(rec)
+            self.checkpoint()
+        else:
+            self._flush(self._find_record(key))
+
+    def checkpoint(self):
+        """Save cursors of records that moved to another block since the last checkpoint to the journal.
+        Within a block, next is found from the checkpoint by reading that block.
+        Records with staged items are saved at their last flushed position at the next checkpoint."""
+        if not self._journal_blocks: return
+        BLOCK_SIZE = self.BLOCK_SIZE
+        changed = [ (i, r) for i, r in enumerate(self._records)
+                    if not r.get('staged') and r['next'] // BLOCK_SIZE != r.get('checkpoint', -BLOCK_SIZE) // BLOCK_SIZE ]
+        if not changed: return
+        size = self._journal_blocks * BLOCK_SIZE
+        if self._journal_next + len(changed)*JOURNAL_SIZE > size:
+            # journal full, start over with all records
+            for i in range(self._journal_blocks):
+                _erase_block(self._bdev, self._journal_addr+i)
+            self._journal_next = 0
+            changed = [ (i, r) for i, r in enumerate(self._records) if not r.get('staged') ][:size // JOURNAL_SIZE]
+        buf = bytearray(len(changed)*JOURNAL_SIZE)
+        for j, (i, r) in enumerate(changed):
+            struct.pack_into(JOURNAL_FMT, buf, j*JOURNAL_SIZE, i, r['next'])
+            r['checkpoint'] = r['next']
+        # one write per journal block
+        mv = memoryview(buf)
+        pos = 0
+        while pos < len(buf):
+            addr = self._journal_next
+            n = min(len(buf)-pos, BLOCK_SIZE - addr % BLOCK_SIZE)
+            self._bdev.writeblocks(self._journal_addr + addr // BLOCK_SIZE, mv[pos:pos+n], addr % BLOCK_SIZE)
+            pos += n
+            self._journal_next += n
+
     def delete_record(self, key: str):
         """Mark record "deleted".
         Note: the data is not actually removed from the database and can still be accessed by setting 
@@ -200,8 +273,9 @@ class TSDB:
             index, rec = next((i, x) for i, x in enumerate(self._records) if x['key'] == key and x['type'] == DIR_TYPE_CBUF)
         except StopIteration:
             raise TSDBException(f"Record '{key}' not in database")
+        self._flush(rec)
         # write new record
-        new_rec = struct.pack(DIR_RECORD_FMT, DIR_TYPE_DEL, rec['block_addr'], rec['nblocks'], key)
+        new_rec = struct.pack(DIR_RECORD_FMT, DIR_TYPE_DEL, rec['block_addr'], rec['nblocks'], key.encode())
         byte_addr = index*DIR_RECORD_SIZE
         block_num = byte_addr // self.BLOCK_SIZE
         offset    = byte_addr %  self.BLOCK_SIZE
@@ -221,6 +295,30 @@ class TSDB:
             s.write(f"  {r['key']:30} capacity: {self.record_capacity(r['key'])} @ block address {r['block_addr']:4}\n")
         return s.getvalue()
     
+    def _stage(self, rec, nxt, timestamp, value, end_of_block):
+        """Stage item for address nxt in RAM, write staged items when full, old, or at end of block.
+        Staged items are contiguous and in a single block."""
+        stage = rec.get('stage')
+        if stage is None:
+            stage = rec['stage'] = bytearray(self._buffer_items * ITEM_SIZE)
+            rec['staged'] = 0
+        n = rec['staged']
+        if n == 0:
+            rec['stage_addr'] = nxt
+            rec['staged_at'] = ticks_ms()
+        struct.pack_into(ITEM_FMT, stage, n*ITEM_SIZE, timestamp, value)
+        rec['staged'] = n = n+1
+        if end_of_block or n >= self._buffer_items or ticks_diff(ticks_ms(), rec['staged_at']) >= self._flush_ms:
+            self._flush(rec)
+
+    def _flush(self, rec):
+        n = rec.get('staged')
+        if not n: return
+        addr = rec['stage_addr']
+        BLOCK_SIZE = self.BLOCK_SIZE
+        self._bdev.writeblocks(rec['block_addr'] + addr // BLOCK_SIZE, memoryview(rec['stage'])[:n*ITEM_SIZE], addr % BLOCK_SIZE)
+        rec['staged'] = 0
+
     def _find_record(self, key: str, ignore_deleted=True):
         try:
             rec = next(x for x in self._records if (x['key'] == key) and (x['type'] == DIR_TYPE_CBUF or not ignore_deleted))
@@ -259,17 +357,93 @@ class TSDB:
                 if tp == DIR_TYPE_BLANK: return
                 rec = { 'key': key, 'block_addr': addr, 'nblocks': n, 'type': tp }
                 self._records.append(rec) 
-                self._find_start_next(rec)
 
-    def _find_start_next(self, rec):
-        """Determine addresses (addr) for first item (start) and insert point (next) in circular buffer."""
+    def _read_journal(self):
+        """Latest checkpoint of each record, dict index -> next."""
+        checkpoints = {}
+        BLOCK_SIZE = self.BLOCK_SIZE
+        buf = bytearray(BLOCK_SIZE)
+        mv = memoryview(buf)
+        self._journal_next = 0
+        for block in range(self._journal_blocks):
+            self._bdev.readblocks(self._journal_addr+block, buf)
+            for offset in range(0, BLOCK_SIZE, JOURNAL_SIZE):
+                if mv[offset:offset+JOURNAL_SIZE] == BLANK:
+                    return checkpoints
+                index, nxt = struct.unpack_from(JOURNAL_FMT, buf, offset)
+                checkpoints[index] = nxt
+                self._journal_next += JOURNAL_SIZE
+        return checkpoints
+
+    def _find_start_next(self, rec, checkpoint=None):
+        """Determine addresses (addr) for first item (start) and insert point (next) in circular buffer.
+        Uses checkpoint (next) if next is still in its block, otherwise a binary search over blocks."""
+        nxt = None
+        if checkpoint is not None:
+            nxt = self._resume_next(rec, checkpoint)
+        if nxt is not None:
+            rec['checkpoint'] = checkpoint
+        else:
+            nxt = self._search_next(rec)
+            if nxt is None:
+                # search fails only if timestamps are not increasing
+                nxt = self._scan_next(rec)
+        if nxt < 0:
+            # empty database
+            rec['start'] = rec['next'] = 0
+            return
+        rec['start'] = self._start(rec, nxt)
+        rec['next']  = nxt
+
+    def _resume_next(self, rec, checkpoint):
+        """First blank item in the block of checkpoint, None if it is not next."""
+        BLOCK_SIZE = self.BLOCK_SIZE
+        size = rec['nblocks'] * BLOCK_SIZE
+        if not (0 <= checkpoint < size): return None
+        block = checkpoint // BLOCK_SIZE
+        buf = bytearray(BLOCK_SIZE)
+        self._bdev.readblocks(rec['block_addr']+block, buf)
+        nxt = (block*BLOCK_SIZE + _fill(buf)*ITEM_SIZE) % size
+        return nxt if self._valid_next(rec, nxt) else None
+
+    def _valid_next(self, rec, nxt):
+        """next is blank and follows a written item."""
+        size = rec['nblocks'] * self.BLOCK_SIZE
+        if not (0 <= nxt < size) or nxt % ITEM_SIZE: return False
+        return self._blank(rec, nxt) and not self._blank(rec, (nxt-ITEM_SIZE) % size)
+
+    def _search_next(self, rec):
+        """Binary search for next, -1 if empty, None if not found.
+        Blocks written since the last wrap (from block 0 to next) have increasing first timestamps,
+        greater than those of the older blocks after next."""
+        BLOCK_SIZE = self.BLOCK_SIZE
+        nblocks = rec['nblocks']
+        t0 = self._first_timestamp(rec, 0)
+        if t0 is None:
+            # block 0 blank: empty or next just wrapped to 0
+            return -1 if self._first_timestamp(rec, 1) is None else 0
+        # last block b with first timestamp >= t0
+        lo, hi = 0, nblocks-1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            t = self._first_timestamp(rec, mid)
+            if t is not None and t >= t0:
+                lo = mid
+            else:
+                hi = mid-1
+        # first blank item in block lo
+        buf = bytearray(BLOCK_SIZE)
+        self._bdev.readblocks(rec['block_addr']+lo, buf)
+        nxt = (lo*BLOCK_SIZE + _fill(buf)*ITEM_SIZE) % (nblocks*BLOCK_SIZE)
+        return nxt if self._valid_next(rec, nxt) else None
+
+    def _scan_next(self, rec):
+        """Find next by reading all blocks, -1 if empty."""
         BLOCK_SIZE = self.BLOCK_SIZE
         buf = bytearray(BLOCK_SIZE)
         nblocks = rec['nblocks']
         block_addr = rec['block_addr']
-        bdev = self._bdev
 
-        nxt = -1
         for block in range(nblocks):
             a, b = self._block_fill(block_addr+block, buf)
             if not a and not b:
@@ -277,42 +451,124 @@ class TSDB:
                 nxt_block = (block+1) % nblocks
                 aa, bb = self._block_fill(block_addr+nxt_block, buf)
                 if aa and bb:
-                    nxt = nxt_block * BLOCK_SIZE
-                    break
+                    return nxt_block * BLOCK_SIZE
             if not a and b:
                 # partially full block
                 mv = memoryview(buf)
-                blank = b'\xff\xff\xff\xff\xff\xff\xff\xff'
                 for offset in range(0, BLOCK_SIZE, ITEM_SIZE):
-                    if mv[offset:offset+ITEM_SIZE] == blank:                      
-                        nxt = block*BLOCK_SIZE + offset
-                        break
-                assert mv[offset:offset+ITEM_SIZE] == blank
-                break
-                
-        if nxt == -1:
-            # empty database
-            rec['start'] = rec['next'] = 0
-            return
-        # start is beginning of first non-empty block after next
-        block = nxt // BLOCK_SIZE
-        while True:
-            block = (block+1) % nblocks
-            a, b = self._block_fill(block_addr+block, buf)
-            if not a:
-                start = block * BLOCK_SIZE
-                break
-        rec['start'] = start
-        rec['next']  = nxt
+                    if mv[offset:offset+ITEM_SIZE] == BLANK:                      
+                        return block*BLOCK_SIZE + offset
+        return -1
+
+    def _start(self, rec, nxt):
+        """start is the beginning of the block after next's block, if written, else 0."""
+        BLOCK_SIZE = self.BLOCK_SIZE
+        block = (nxt // BLOCK_SIZE + 1) % rec['nblocks']
+        return 0 if self._blank(rec, block*BLOCK_SIZE) else block*BLOCK_SIZE
+
+    def _buffers(self, rec, t_from=None):
+        """(buffer, number of items or None if up to the first blank) from start to next:
+        each block (read into the same buffer), followed by the staged items."""
+        buf = bytearray(self.BLOCK_SIZE)
+        for block in self._blocks(rec, t_from):
+            self._bdev.readblocks(rec['block_addr'] + block, buf)
+            yield buf, None
+        # staged items follow the last item on block_dev
+        if rec.get('staged'):
+            yield rec['stage'], rec['staged']
+
+    def _blocks(self, rec, t_from=None):
+        """Blocks from start to next, beginning with the first block that may contain t_from.
+        First timestamps increase from block to block, hence the binary search."""
+        BLOCK_SIZE = self.BLOCK_SIZE
+        nblocks = rec['nblocks']
+        first = rec['start'] // BLOCK_SIZE
+        count = (rec['next'] // BLOCK_SIZE - first) % nblocks + 1
+        lo = 0
+        if t_from is not None:
+            # last block with first timestamp < t_from: repeated timestamps may span blocks
+            hi = count-1
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                t = self._first_timestamp(rec, (first+mid) % nblocks)
+                if t is not None and t < t_from:
+                    lo = mid
+                else:
+                    hi = mid-1
+        return ((first+i) % nblocks for i in range(lo, count))
+
+    def _first_timestamp(self, rec, block):
+        """Timestamp of first item in block, None if blank."""
+        if self._blank(rec, block*self.BLOCK_SIZE): return None
+        return struct.unpack_from('I', self._item)[0]
+
+    def _blank(self, rec, addr):
+        """Item at addr is blank, reads it into self._item."""
+        BLOCK_SIZE = self.BLOCK_SIZE
+        self._bdev.readblocks(rec['block_addr'] + addr // BLOCK_SIZE, self._item, addr % BLOCK_SIZE)
+        return self._item == BLANK
 
     def _block_fill(self, block_num, buf):
         """Check block status
            @return (start empty, tail empty)"""
-        blank = b'\xff\xff\xff\xff\xff\xff\xff\xff'
         self._bdev.readblocks(block_num, buf)
-        return (buf[:8]  == blank, buf[-8:] == blank)
+        return (buf[:8]  == BLANK, buf[-8:] == BLANK)
     
 
+# buffer size -> struct format for all items of a buffer
+_formats = {}
+
+def _decode(buf, n, ts, val, t_from, t_to, limit):
+    """Append items buf[:n] (n=None: up to the first blank) with t_from <= timestamp <= t_to
+    to ts and val, up to limit items. Timestamps must be increasing.
+    Unpacks all items of buf with a single struct.unpack.
+    @return True past t_to or at limit"""
+    if n is None:
+        n = _fill(buf)
+    if not n:
+        return False
+    fmt = _formats.get(len(buf))
+    if fmt is None:
+        fmt = _formats[len(buf)] = ITEM_FMT * (len(buf) // ITEM_SIZE)
+    items = struct.unpack_from(fmt, buf)
+    t = items[0:2*n:2]
+    lo, hi = 0, n
+    done = False
+    if t_from is not None:
+        lo = _bisect(t, t_from, 0, n)
+    if t_to is not None and t[n-1] > t_to:
+        hi = _bisect(t, t_to+1, lo, n)
+        done = True
+    if limit is not None and hi-lo >= limit-len(ts):
+        hi = lo + limit-len(ts)
+        done = True
+    if hi > lo:
+        ts.extend(array('I', t[lo:hi]))
+        val.extend(array('f', items[2*lo+1:2*hi:2]))
+    return done
+
+def _bisect(t, x, lo, hi):
+    """Index of first t >= x in t[lo:hi] (hi if none)."""
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if t[mid] < x:
+            lo = mid+1
+        else:
+            hi = mid
+    return lo
+
+def _fill(buf):
+    """Number of items before the first blank, items are written in order."""
+    mv = memoryview(buf)
+    a, b = 0, len(buf) // ITEM_SIZE
+    while a < b:
+        m = (a + b) // 2
+        if mv[m*ITEM_SIZE:(m+1)*ITEM_SIZE] == BLANK:
+            b = m
+        else:
+            a = m+1
+    return a
+
 def _erase_block(bdev, block_num):
     assert block_num < bdev.ioctl(4, None)
     bdev.ioctl(6, block_num)
@@ -322,16 +578,69 @@ def is_power_of_2(n):
 
 
 
+# opened by init
+db = None
 
-from esp32 import Partition    # type: ignore
-
-def init(partition='data_1'):
-    global db, bdev
+def init(partition='data_1', buffer_items=16, flush_ms=10_000, history_chunk=128, journal_blocks=4):
+    global db, bdev, _history_chunk
+    # config returns strings!
+    buffer_items, flush_ms, _history_chunk, journal_blocks = int(buffer_items), int(flush_ms), int(history_chunk), int(journal_blocks)
+    from esp32 import Partition    # type: ignore
     bdev = Partition.find(type=Partition.TYPE_DATA, label=partition)[0]
     try:
-        db = TSDB(bdev)
+        db = TSDB(bdev, buffer_items, flush_ms)
     except TSDBException as e:
         logger.exception("Failed initializing tsdb - creating new one", e)
         bdev = Partition.find(type=Partition.TYPE_DATA, label='data_1')[0]
-        TSDB.make_db(bdev, 4096)
-        db = TSDB(bdev)
+        # the journal is erased when full: more blocks, fewer erase cycles
+        TSDB.make_db(bdev, 4096, journal_blocks=journal_blocks)
+        db = TSDB(bdev, buffer_items, flush_ms)
+    asyncio.create_task(_flush_task(flush_ms))
+    from app import event_bus
+    event_bus.subscribe(_handle_history_event, types="get_history")
+
+async def _flush_task(flush_ms):
+    # write staged items of records that are not appended to regularly, checkpoint cursors
+    while True:
+        await asyncio.sleep_ms(flush_ms)
+        db.flush()
+
+
+def _range(t_from, t_to):
+    return (None if t_from is None else int(t_from)), (None if t_to is None else int(t_to))
+
+async def _handle_history_event(event):
+    """get_history: key, optional t_from, t_to.
+    Response: get_history_ with key, timestamps, values, chunk, last (or error)"""
+    from app import event_bus
+    key = event.get('key')
+    dst = event.get('src', '*')
+    try:
+        t_from, t_to = _range(event.get('t_from'), event.get('t_to'))
+        chunk = 0
+        prev = None
+        # send previous chunk, to set last on the final one
+        for data in db.iter_values(key, t_from, t_to, _history_chunk):
+            if prev:
+                await event_bus.post(type='get_history_', key=key, timestamps=list(prev['timestamps']), values=list(prev['values']), chunk=chunk, last=False, dst=dst)
+                chunk += 1
+            prev = data
+        await event_bus.post(type='get_history_', key=key, timestamps=list(prev['timestamps']) if prev else [], values=list(prev['values']) if prev else [], chunk=chunk, last=True, dst=dst)
+    except (TSDBException, ValueError) as e:
+        await event_bus.post(type='get_history_', key=key, error=str(e), last=True, dst=dst)
+
+def history_json(key, t_from=None, t_to=None):
+    """Generator of json text: a list of chunks { "timestamps": [...], "values": [...] } for key.
+    Raises TSDBException if key is not in database."""
+    t_from, t_to = _range(t_from, t_to)
+    if db is None:
+        raise TSDBException("tsdb not initialized")
+    # raise now rather than while streaming
+    db._find_record(key)
+    def gen():
+        sep = '['
+        for data in db.iter_values(key, t_from, t_to, _history_chunk):
+            yield sep + json.dumps({ 'timestamps': list(data['timestamps']), 'values': list(data['values']) })
+            sep = ', '
+        yield ']' if sep == ', ' else '[]'
+    return gen()
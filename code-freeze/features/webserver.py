@@ -52,6 +52,18 @@ async def test(request):
     from tests import run_all
     return await run_all()
 
+@webapp.get('/history/<key>')
+async def history(request, key):
+    # streamed in chunks, optional query parameters t_from, t_to
+    from features import tsdb
+    try:
+        body = tsdb.history_json(key, request.args.get('t_from'), request.args.get('t_to'))
+    except tsdb.TSDBException as e:
+        return str(e), 404
+    except ValueError as e:
+        return str(e), 400
+    return body, 200, { 'Content-Type': 'application/json' }
+
 @webapp.get('/ws')
 @with_websocket
 async def websocket(request, ws):
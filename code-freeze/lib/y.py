@@ -1,4 +1,3 @@
-import re
 import logging
 from io import StringIO
 from collections import OrderedDict
@@ -18,12 +17,33 @@ def is_scalar(obj):
     except:
         return True
 
+def _quote(s, context=''):
+    """s, quoted if it would not load back as itself.
+    @param context: 'key' for dict keys, 'item' for list items (and top-level scalars)"""
+    if not isinstance(s, str):
+        return s
+    if s and s == s.strip() and not s[0] in '"\'' and not '#' in s:
+        if context == 'key':
+            if not ': ' in s and s[0] != '-': return s
+        elif context == 'item':
+            if not ':' in s: return s
+        else:
+            return s
+    q = "'" if '"' in s else '"'
+    if q in s:
+        logger.error(f"cannot quote {s}, contains both quote characters")
+    return q + s + q
+
 def dump(obj, stream, indent=0):
     global _INDENT
     if isinstance(obj, dict):
         for key, value in obj.items():
-            if is_scalar(value):
-                stream.write(f"{_INDENT*indent}{key}: {value}\n")
+            key = _quote(key, 'key')
+            if value is None:
+                # loads back as None
+                stream.write(f"{_INDENT*indent}{key}:\n")
+            elif is_scalar(value):
+                stream.write(f"{_INDENT*indent}{key}: {_quote(value)}\n")
             else:
                 stream.write(f"{_INDENT*indent}{key}:\n")
                 dump(value, stream, indent+1)
@@ -38,7 +58,7 @@ def dump(obj, stream, indent=0):
                 else:
                     stream.write(f"{_INDENT*indent}  {l}")
     else:
-        stream.write(f"{_INDENT*indent}{obj}\n")
+        stream.write(f"{_INDENT*indent}{_quote(obj, 'item')}\n")
 
 
 def dumps(obj):
@@ -70,7 +90,7 @@ class Y:
             if self._indent < 0: 
                 # eof
                 return None
-            if self._key or self._value:
+            if self._key or self._value is not None:
                 return self._parse_list(indent) if self._list else self._parse_dict(indent)
             self._next()
 
@@ -79,9 +99,9 @@ class Y:
         if self._indent < indent: self._syntax("indentation")
         indent = self._indent
         while True:
-            if self._key and self._value:
+            if self._key and self._value is not None:
                 result[self._key] = self._value
-            elif self._value:
+            elif self._value is not None:
                 self._syntax("missing colon")
             elif self._key:
                 key = self._key
@@ -108,15 +128,18 @@ class Y:
         while True:
             if self._list:
                 # append list element
-                if self._key and self._value:
-                    result.append(OrderedDict({ self._key: self._value }))
-                elif self._value:
+                if self._key and self._value is not None:
+                    d = OrderedDict()
+                    d[self._key] = self._value
+                    result.append(d)
+                elif self._value is not None:
                     result.append(self._value)
                 elif self._key:
                     key = self._key
                     self._next()
-                    value = None if self._indent <= indent else self._parse(indent+1)
-                    result.append(OrderedDict({ key: value }))
+                    d = OrderedDict()
+                    d[key] = None if self._indent <= indent else self._parse(indent+1)
+                    result.append(d)
                     if self._indent < indent:
                         # end of dict or eof
                         return result
@@ -124,13 +147,13 @@ class Y:
                     continue
             else:
                 # merge into dict
-                if self._key and self._value:
+                if self._key and self._value is not None:
                     d = result[-1]
                     if not isinstance(d, dict): 
                         self._syntax("not a dictionary")
                     else:
                         d[self._key] = self._value
-                elif self._value:
+                elif self._value is not None:
                     self._syntax("expected dash")
                 elif self._key:
                     key = self._key
@@ -156,84 +179,85 @@ class Y:
     #################################
     # lexer
 
-    _RE_INDENT = re.compile(r'(\s*)(-?)\s*(.*)')
-    _RE_QKEY   = re.compile(r'("[^"]*"|\'[^\']*\')(:?)(.*)')
-    _RE_QVALUE = re.compile(r'\s*("[^"]*"|\'[^\']*\')\s*([^#]*)')
-
     def _next(self):
+        # single pass over the next non-empty line, str methods only (no regex)
         self._key = self._value = None
+        readline = self._stream.readline
         while True:
-            # loop until we get a non-empty line (or eof)
-            if self._key or self._value:
-                # successful parse
-                return
-                
-            # parse next (non-empty} line
-            self._line = self._stream.readline()
-            if not self._line: 
+            line = readline()
+            if not line: 
                 # EOF
                 self._indent = -1
-                self._line = self._key = self._value = None
+                self._line = None
                 return
-            self._line = self._line.rstrip()
             self._line_no += 1
+            line = line.rstrip()
+            if not line: continue
+            self._line = line
 
             # indent, dash
-            indent, dash, rest = self._RE_INDENT.match(self._line).groups()
-            if '\t' in indent: 
+            rest = line.lstrip()
+            indent = len(line) - len(rest)
+            if indent and '\t' in line[:indent]:
                 self._syntax('tab')
-            self._indent = len(indent)
-            self._list = dash == '-'
-
-            # quoted key?
-            if m := self._RE_QKEY.match(rest):
-                key, colon, value = m.groups()
-                if '\t' in indent: 
-                    self._syntax('tab')
-                self._indent = len(indent)
-                self._list = dash == '-'
-                self._key = key[1:-1]
-                if colon == ':':
-                    self._value = self._parse_value(value)
+            self._indent = indent
+            self._list = rest[0] == '-'
+            if self._list:
+                rest = rest[1:].lstrip()
+
+            key = value = None
+            q = rest[:1]
+            if (q == '"' or q == "'") and (i := rest.find(q, 1)) > 0:
+                # quoted key
+                if rest[i+1:i+2] == ':':
+                    key = rest[1:i]
+                    value = self._parse_value(rest[i+2:])
                 else:
-                    self._value = self._key
-                    self._key = None
-                continue
-                
-            # key not quoted
-            kv = rest.split(': ', 1)
-            if len(kv) == 2:
-                key, value = kv
-                colon = ': '
-            else: 
-                key, colon, value = rest.rpartition(':')
-                
-            if colon:
-                if '#' in key:
-                    key, _ = key.split('#', 1)
-                    key = key.strip()
-                    if key.endswith(':'):
-                        self._key = key[0:-1]
-                        self._value = None
-                    else:
-                        self._key = None
-                        self._value = key
+                    # quoted value, trailer ignored
+                    value = rest[1:i]
+            else:
+                # key not quoted
+                i = rest.find(': ')
+                if i >= 0:
+                    j = i + 2
                 else:
-                    self._key = key
-                    self._value = self._parse_value(value)
-                continue
-
-            self._key = None
-            self._value = self._parse_value(rest)
+                    i = rest.rfind(':')
+                    j = i + 1
+                if i < 0:
+                    value = self._parse_value(rest)
+                else:
+                    key = rest[:i]
+                    h = key.find('#')
+                    if h < 0:
+                        value = self._parse_value(rest[j:])
+                    else:
+                        key = key[:h].strip()
+                        if key.endswith(':'):
+                            key = key[:-1]
+                        else:
+                            value = key or None
+                            key = None
+            if key or value is not None:
+                self._key = key
+                self._value = value
+                return
 
     def _parse_value(self, v):
-        if m := self._RE_QVALUE.match(v):
-            if m.group(2):
-                self._syntax(f"unexpected trailer: {m.group(2)} (ignored)")
-            return str(m.group(1))[1:-1]
-        if '#' in v:
-            v, _ = v.split('#', 1)
-        return v.strip()
+        s = v.lstrip()
+        q = s[:1]
+        if (q == '"' or q == "'") and (i := s.find(q, 1)) > 0:
+            # quoted, anything but whitespace before a comment is an error
+            trailer = s[i+1:]
+            h = trailer.find('#')
+            if h >= 0: trailer = trailer[:h]
+            trailer = trailer.lstrip()
+            if trailer:
+                self._syntax(f"unexpected trailer: {trailer} (ignored)")
+            return s[1:i]
+        h = v.find('#')
+        if h >= 0: v = v[:h]
+        # empty unquoted value is None, "" is the empty string
+        return v.strip() or None
 
     def _syntax(self, msg):
         logger.error(f"Syntax error in {self.file_name} line {self._line_no} '{self._line.strip()}': {msg}")
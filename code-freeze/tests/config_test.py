@@ -0,0 +1,43 @@
+import unittest
+import os
+
+from app.config import Config, CONFIG_DIR, CONFIG_EXT, SNAPSHOT_DIR
+
+SECTION = 'test_config'
+
+
+class TestConfig(unittest.TestCase):
+
+    # private instances: reloading the shared config would discard its unsaved changes
+
+    def setUp(self):
+        self.config = Config()
+
+    def tearDown(self):
+        if self.config._save_task:
+            self.config._save_task.cancel()
+        for f in [ f"{CONFIG_DIR}/{SECTION}.{CONFIG_EXT}", f"{SNAPSHOT_DIR}/{SECTION}.json" ]:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def test_save_load(self):
+        # set -> save -> reload returns what was set
+        values = {
+            'password': 'p#ss',
+            'quoted': "'home'",
+            'double': '"x"',
+            'empty': '',
+            'blanks': ' a ',
+            'colon': 'a: b',
+            'none': None,
+            'list': [ 'x: y', '', '#', '- z', 'z' ],
+            'nested': { 'k: v': 'w', '-dash': '1' },
+        }
+        for k, v in values.items():
+            self.config.set(f"{SECTION}/{k}", v)
+        self.config.save()
+        reloaded = Config()
+        for k, v in values.items():
+            self.assertEqual(reloaded.get(f"{SECTION}/{k}"), v)
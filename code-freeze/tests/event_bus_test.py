@@ -0,0 +1,42 @@
+import unittest
+
+from app.event_bus import _EventQueue, DROP_OLDEST
+
+
+def update(entity_id, value):
+    return { 'type': 'state_update', 'entity_id': entity_id, 'value': value }
+
+def drain(q):
+    res = []
+    while len(q):
+        res.append(q.get_nowait())
+    return res
+
+
+class TestEventQueue(unittest.TestCase):
+
+    def test_coalesce(self):
+        q = _EventQueue(8, DROP_OLDEST, coalesce=True)
+        for event in [ update('a', 1), update('b', 1), update('a', 2) ]:
+            q.put_nowait(event)
+        self.assertEqual(drain(q), [ update('a', 2), update('b', 1) ])
+        self.assertEqual(q.coalesced, 1)
+
+    def test_coalesce_batch(self):
+        # a=3 must not replace a=1 queued before the batch: a would end up 2
+        q = _EventQueue(8, DROP_OLDEST, coalesce=True)
+        batch = { 'type': 'state_batch', 'updates': { 'a': 2, 'b': 2 } }
+        for event in [ update('a', 1), batch, update('a', 3) ]:
+            q.put_nowait(event)
+        self.assertEqual(drain(q), [ update('a', 1), batch, update('a', 3) ])
+        # slot of a=3 was released, a new update is queued again
+        q.put_nowait(update('a', 4))
+        self.assertEqual(drain(q), [ update('a', 4) ])
+
+    def test_coalesce_response(self):
+        # a=2 must not overtake the older state in get_state_
+        q = _EventQueue(8, DROP_OLDEST, coalesce=True)
+        response = { 'type': 'get_state_', 'data': { 'a': 1 } }
+        for event in [ update('a', 1), response, update('a', 2), update('a', 3) ]:
+            q.put_nowait(event)
+        self.assertEqual(drain(q), [ update('a', 1), response, update('a', 3) ])
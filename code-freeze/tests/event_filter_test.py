@@ -0,0 +1,87 @@
+import unittest
+from array import array
+from time import sleep_ms   # type: ignore
+
+from app.event_filter import *
+
+
+def run(f, values):
+    # values passed by filter f
+    res = []
+    for v in values:
+        v = f.filter(v)
+        if not v is NO_UPDATE:
+            res.append(v)
+    return res
+
+
+class TestEventFilter(unittest.TestCase):
+
+    def test_rate(self):
+        f = RateFilter('0.05')
+        self.assertEqual(run(f, [1, 2, 3]), [1])
+        sleep_ms(60)
+        self.assertEqual(run(f, [4, 5]), [4])
+
+    def test_heartbeat(self):
+        f = HeartbeatFilter('0.05')
+        self.assertEqual(run(f, [1, 1, 2, 2, 1]), [1, 2, 1])
+        sleep_ms(60)
+        self.assertEqual(run(f, [1, 1]), [1])
+
+    def test_deadband(self):
+        f = DeadbandFilter({ 'abstol': '0.5', 'reltol': '0.1' })
+        # tolerance is 0.5 + 0.1*|last|
+        self.assertEqual(run(f, [10, 11, 11.4, 9.6, 8, 8.2]), [10, 8])
+        f = DeadbandFilter({ 'abstol': '1', 'max_interval': '0.05' })
+        self.assertEqual(run(f, [1, 1.5, 1.5]), [1])
+        sleep_ms(60)
+        self.assertEqual(run(f, [1.5, 1.6]), [1.5])
+
+    def test_window(self):
+        values = [1, 5, 2, 100, 3, 4, float('nan'), 2]
+        self.assertEqual(run(MedianFilter(3), values), [1, 3, 2, 5, 3, 4, 3])
+        self.assertEqual(run(MeanFilter(2), values), [1, 3, 3.5, 51, 51.5, 3.5, 3])
+        self.assertEqual(run(MinFilter(3), values), [1, 1, 1, 2, 2, 3, 2])
+        self.assertEqual(run(MaxFilter(3), values), [1, 5, 5, 100, 100, 100, 4])
+
+    def test_decimate(self):
+        self.assertEqual(run(DecimateFilter(3), list(range(10))), [0, 3, 6, 9])
+
+    def test_compile_chain(self):
+        chain = compile_chain([ 'duplicate', { 'offset': '1' }, { 'scale': '2' }, { 'offset': '-3' } ])
+        self.assertEqual(run(chain, [1, 1, 2, 2, 4]), [1, 3, 7])
+        self.assertEqual(run(compile_chain([]), [1, 1]), [1, 1])
+        self.assertEqual(run(compile_chain([ { 'scale': '10' } ]), [1, 1]), [10, 10])
+        self.assertEqual(run(compile_chain([ 'duplicate', { 'decimate': '2' }, 'duplicate' ]), [1, 2, 2, 3, 4, 5, 6]), [1, 3, 5])
+
+    def test_filter_array(self):
+        ts = array('I', range(0, 1000, 100))
+        vs = array('h', [1, 1, 2, 2, 3, 50, 3, 3, 4, 4])
+        # filter_array and filter_at produce the same output
+        for spec in [ [ 'duplicate' ], [ { 'scale': '2' }, { 'offset': '1' } ], [ { 'decimate': '3' } ],
+                      [ { 'median': '3' }, { 'decimate': '2' } ], [ { 'rate': '0.25' } ],
+                      [ { 'deadband': { 'abstol': '1', 'max_interval': '0.3' } } ], [ { 'lpf': '0.2' } ] ]:
+            with self.subTest(f"{spec}"):
+                ta, va = compile_chain(spec).filter_array(ts, vs)
+                chain = compile_chain(spec)
+                expected = []
+                for t, v in zip(ts, vs):
+                    v = chain_at(chain, v, t)
+                    if not v is NO_UPDATE: expected.append((t, v))
+                self.assertEqual(list(ta), [ t for t, _ in expected ])
+                for a, b in zip(va, [ v for _, v in expected ]):
+                    self.assertAlmostEqual(a, b, places=4)
+        # state is kept between blocks
+        f = DecimateFilter(4)
+        _, a = f.filter_array(ts, vs)
+        _, b = f.filter_array(ts, vs)
+        self.assertEqual(list(a) + list(b), [1, 3, 4, 2, 3])
+
+
+def chain_at(chain, value, t):
+    # scalar reference for filter_array
+    for f in chain._filters:
+        value = f.filter_at(value, t)
+        if value is NO_UPDATE: break
+    return value
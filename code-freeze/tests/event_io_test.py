@@ -0,0 +1,45 @@
+import unittest
+import asyncio
+import json
+
+from app import event_bus
+from app.event_io import EventIO
+
+
+class SlowWebSocket:
+    # slower than event_bus.post (10 ms)
+
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+
+    async def send(self, data):
+        await asyncio.sleep_ms(30)
+        self.sent.append(json.loads(data))
+
+    async def close(self):
+        self.closed = True
+
+
+async def slow_client(n):
+    ws = SlowWebSocket()
+    io = EventIO(ws, queue_size=4)
+    mailbox = event_bus.mailbox(io._susbscriber)
+    for i in range(n):
+        await event_bus.post(type='get_history_', chunk=i, last=i == n-1, dst=io._client_id)
+        # addressed to another client
+        await event_bus.post(type='get_history_', chunk=i, dst='event-io-0')
+    while mailbox.pending or mailbox._busy:
+        await asyncio.sleep_ms(10)
+    dropped = mailbox.dropped
+    await io._close()
+    return ws.sent, dropped
+
+
+class TestEventIO(unittest.TestCase):
+
+    def test_slow_client(self):
+        # responses addressed to a client are not dropped when its queue is full
+        sent, dropped = asyncio.run(slow_client(16))
+        self.assertEqual([ e['chunk'] for e in sent ], list(range(16)))
+        self.assertEqual(dropped, 0)
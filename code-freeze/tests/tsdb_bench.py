@@ -0,0 +1,91 @@
+"""Decode speed of TSDB on a RAMBlockDev.
+
+Host:   python3 tests/tsdb_bench.py
+Device: import tsdb_bench
+"""
+
+import sys
+import struct
+from array import array
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    # host
+    import os
+    import time
+    import types
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+    # MicroPython builtins used by tsdb
+    time.ticks_ms = lambda: perf_counter_ns() // 1_000_000
+    time.ticks_diff = ticks_diff
+    micropython = types.ModuleType('micropython')
+    micropython.const = lambda x: x
+    sys.modules['micropython'] = micropython
+
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(_dir)
+    sys.path.append(os.path.join(_dir, '..'))
+
+from tsdb_test import RAMBlockDev
+from features.tsdb import TSDB, ITEM_FMT, ITEM_SIZE, BLANK
+
+BLOCK_SIZE = 4096
+NBLOCKS    =  128
+
+
+def per_item(db, key):
+    """Reference: decode with one struct.unpack per item."""
+    rec = db._find_record(key)
+    buf = bytearray(db.BLOCK_SIZE)
+    mv = memoryview(buf)
+    val = array('f')
+    ts  = array('I')
+    for block in db._blocks(rec):
+        db._bdev.readblocks(rec['block_addr'] + block, buf)
+        for offset in range(0, db.BLOCK_SIZE, ITEM_SIZE):
+            item = mv[offset:offset+ITEM_SIZE]
+            if item == BLANK:
+                break
+            t, v = struct.unpack(ITEM_FMT, item)
+            val.append(v)
+            ts.append(t)
+    return { 'timestamps': ts, 'values': val }
+
+
+def bench(name, f, blocks, repeat=5):
+    res = f()
+    t0 = ticks_us()
+    for _ in range(repeat):
+        f()
+    dt = ticks_diff(ticks_us(), t0) / repeat
+    print(f"{name:14} {dt/1000:10.2f} ms {dt/max(1, blocks):8.0f} us/block")
+    return res
+
+
+def run():
+    bdev = RAMBlockDev(BLOCK_SIZE, NBLOCKS)
+    TSDB.make_db(bdev, 16)
+    db = TSDB(bdev, buffer_items=64)
+    db.create_record('a', (NBLOCKS-8) * BLOCK_SIZE // ITEM_SIZE)
+    N = db.record_capacity('a') + BLOCK_SIZE // ITEM_SIZE // 2
+    for i in range(N):
+        db.append('a', i, i / 10)
+    db.flush()
+    blocks = len(list(db._blocks(db._find_record('a'))))
+    print(f"{N} items, {blocks} blocks of {BLOCK_SIZE} bytes")
+    ref = bench('per item', lambda: per_item(db, 'a'), blocks)
+    res = bench('values', lambda: db.values('a'), blocks)
+    assert res['timestamps'] == ref['timestamps'] and res['values'] == ref['values']
+    bench('values 1%', lambda: db.values('a', N - N // 100), (N // 100) * ITEM_SIZE // BLOCK_SIZE + 1)
+    bench('iter_values', lambda: [ c for c in db.iter_values('a') ], blocks)
+
+
+run()
@@ -0,0 +1,61 @@
+"""Parse time per KB of y.loads.
+
+Host:   python3 tests/y_bench.py
+Device: import y_bench
+"""
+
+import sys
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    # host
+    import os
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(_dir)
+    sys.path.append(os.path.join(_dir, '..', 'lib'))
+
+import y
+from y_corpus import CASES
+
+
+def devices_yaml(n=100):
+    """devices section with n BLE devices, like the scanner discovers them."""
+    lines = []
+    for i in range(n):
+        lines.append(f"'c0:ff:ee:00:{i // 256:02x}:{i % 256:02x}':")
+        lines.append(f"  alias: sensor_{i} # room {i}")
+        lines.append(f"  description: \"Govee T/H {i}\"")
+        lines.append(f"  key: 0123456789abcdef0123456789abcdef")
+        lines.append(f"  entities:")
+        lines.append(f"    - temperature")
+        lines.append(f"    - humidity: {{ unit: '%' }}")
+    return '\n'.join(lines) + '\n'
+
+
+def bench(name, texts, repeat=20):
+    for text in texts:
+        y.loads(text)
+    t0 = ticks_us()
+    for _ in range(repeat):
+        for text in texts:
+            y.loads(text)
+    dt = ticks_diff(ticks_us(), t0) / repeat
+    kb = sum(len(text) for text in texts) / 1024
+    print(f"{name:10} {kb:8.1f} KB {dt/1000:10.2f} ms {dt/kb:10.0f} us/KB")
+
+
+def run():
+    bench('corpus', [ text for text, _ in CASES ], repeat=200)
+    bench('devices', [ devices_yaml() ])
+
+
+run()
@@ -0,0 +1,95 @@
+"""Conformance corpus for y: (yaml, expected) pairs, used by y_test and y_bench."""
+
+from collections import OrderedDict
+
+CASES = [
+(
+"""
+a: aaa
+b: bbb # comment
+
+c:
+dd:00:11:
+dd:33: value_1: value_2
+""",
+OrderedDict({'a': 'aaa', 'b': 'bbb', 'c': None, 'dd:00:11': None, 'dd:33': 'value_1: value_2'})),
+
+(
+"""
+- 1: a
+- 2: b
+- 3
+- 4 # comment
+
+-5
+- 6:
+- 7
+
+""",
+[OrderedDict({'1': 'a'}), OrderedDict({'2': 'b'}), '3', '4', '5', OrderedDict({'6': None}), '7']),
+
+(
+"""
+a:
+    b:
+        c: ccc
+        d: ddd
+    e:
+f:
+""",
+OrderedDict({'a': OrderedDict({'b': OrderedDict({'c': 'ccc', 'd': 'ddd'}), 'e': None}), 'f': None})),
+
+(
+"""
+- 1
+- 2:
+- 3: 333
+  4: 444
+  5:
+      - 555
+      - 666:
+          - 777:
+            888:
+            999:
+                - a
+                - b:
+            000:
+          - aaa
+- 6
+""",
+['1', OrderedDict({'2': None}), OrderedDict({'3': '333', '4': '444', '5': ['555', OrderedDict({'666': [OrderedDict({'777': OrderedDict({'888': None, '999': ['a', OrderedDict({'b': None})], '000': None})}), 'aaa']})]}), '6']),
+
+(
+"""
+    - k1:k2: v1: 4 v2 # comment
+    - "1 k2:k3:k4 ":abc: def #comment
+    - "k": "v" # c
+    - 'k': 'v' # c
+    - 'k': "v'" # c
+    - "a: b':
+      x:
+    - y
+""",
+[OrderedDict({'k1:k2': 'v1: 4 v2'}), OrderedDict({'1 k2:k3:k4 ': 'abc: def'}), OrderedDict({'k': 'v'}), OrderedDict({'k': 'v'}), OrderedDict({'k': "v'"}), OrderedDict({'"a': "b':", 'x': None}), 'y']),
+
+(
+"""
+# comment
+url: http://example.com # c
+k:v
+  # indented comment
+n: '1 2' # c
+""",
+OrderedDict({'url': 'http://example.com', 'k': 'v', 'n': '1 2'})),
+
+(
+"""
+- a
+-b
+- "c" # c
+  # comment
+- 'd': 'e'
+""",
+['a', 'b', 'c', OrderedDict({'d': 'e'})]),
+
+]